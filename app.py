@@ -1,16 +1,44 @@
 import streamlit as st
 import requests
 import pandas as pd
+import numpy as np
 import io
+import bisect
 import datetime
+import gzip
+import hashlib
+import html
+import json
+import math
+import multiprocessing as mp
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import types
+import weakref
+import zipfile
+import zlib
 import xml.etree.ElementTree as ET
 import re
+import functools
+import itertools
 import unicodedata
-from collections import Counter
-from bs4 import BeautifulSoup
+from collections import Counter, deque, namedtuple
+from contextlib import contextmanager
 from openai import OpenAI
 from requests.adapters import HTTPAdapter, Retry
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError as FuturesTimeout, wait
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from streamlit.runtime.scriptrunner_utils.script_run_context import SCRIPT_RUN_CONTEXT_ATTR_NAME
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:     # 열 저장소(Parquet) 기능만 비활성
+    pa = pc = pq = None
 
 
 # ── 한 번만 생성: 국중API용 세션 & 재시도 설정
@@ -33,6 +61,160 @@ nlk_key = st.secrets["api_keys"]["nlk_key"]
 
 gpt_client = OpenAI(api_key=openai_key)
 
+# 📈 파이프라인 지표 — 상류(알라딘/국중/크롤링/OpenAI)별 지연·오류, 캐시 적중
+class UpstreamStats:
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.latencies = deque(maxlen=512)     # 최근 지연(초)
+        self.last_error = ""
+
+    def percentile(self, q):
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+class PipelineStats:
+    """상류 호출·캐시 조회 카운터. 배치 진행 화면이 이 값을 그대로 읽습니다."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tls = threading.local()
+        self.upstreams = {}
+        self.cache_hits = Counter()
+        self.cache_lookups = Counter()
+
+    def _up(self, name):
+        if name not in self.upstreams:
+            self.upstreams[name] = UpstreamStats()
+        return self.upstreams[name]
+
+    @contextmanager
+    def track(self, name):
+        seen = getattr(self._tls, "seen", None)
+        if seen is not None:
+            seen.add(name)
+        t0 = time.monotonic()
+        try:
+            yield
+        except Exception as e:
+            with self._lock:
+                up = self._up(name)
+                up.errors += 1
+                up.last_error = f"{type(e).__name__}: {e}"[:200]
+            raise
+        finally:
+            with self._lock:
+                up = self._up(name)
+                up.calls += 1
+                up.latencies.append(time.monotonic() - t0)
+
+    def observe(self, name, fn, *args, **kwargs):
+        """캐시된 함수 fn을 부르고, 그 안에서 name 상류 호출이 없었으면 캐시 적중으로 셉니다."""
+        self._tls.seen = set()
+        try:
+            result = fn(*args, **kwargs)
+            self.cache(name, name not in self._tls.seen)
+            return result
+        finally:
+            self._tls.seen = None
+
+    def cache(self, name, hit):
+        with self._lock:
+            self.cache_lookups[name] += 1
+            self.cache_hits[name] += bool(hit)
+
+    def counters(self) -> dict:
+        with self._lock:
+            return {
+                "calls": {n: u.calls for n, u in self.upstreams.items()},
+                "errors": {n: u.errors for n, u in self.upstreams.items()},
+                "hits": dict(self.cache_hits),
+                "lookups": dict(self.cache_lookups),
+            }
+
+    def upstream_rows(self, baseline=None) -> list:
+        base = baseline or {"calls": {}, "errors": {}}
+        with self._lock:
+            return [{
+                "상류": n,
+                "호출": u.calls - base["calls"].get(n, 0),
+                "오류": u.errors - base["errors"].get(n, 0),
+                "p50(ms)": round(u.percentile(0.5) * 1000),
+                "p95(ms)": round(u.percentile(0.95) * 1000),
+                "최근 오류": u.last_error,
+            } for n, u in sorted(self.upstreams.items())]
+
+    def hit_rates(self, baseline=None) -> dict:
+        base = baseline or {"hits": {}, "lookups": {}}
+        with self._lock:
+            out = {}
+            for n, total in self.cache_lookups.items():
+                looked = total - base["lookups"].get(n, 0)
+                if looked:
+                    out[n] = (self.cache_hits[n] - base["hits"].get(n, 0)) / looked
+            return out
+
+@st.cache_resource
+def pipeline_stats():
+    return PipelineStats()
+
+# 🔌 상류별 차단기 — 연속 실패가 쌓이면 잠시 호출을 끊고 해당 필드 없이 레코드를 냅니다
+BREAKER_FAILURES = int(os.environ.get("ISBN2MARC_BREAKER_FAILURES", "5"))
+BREAKER_COOLDOWN = float(os.environ.get("ISBN2MARC_BREAKER_COOLDOWN", "60"))
+
+class CircuitBreaker:
+    """closed → (연속 실패 N회) → open → (cooldown 경과) → half-open(시험 호출 1건) → closed/open"""
+
+    def __init__(self, name, failures=BREAKER_FAILURES, cooldown=BREAKER_COOLDOWN):
+        self.name = name
+        self.failures = failures
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._streak = 0
+        self._opened_at = None
+        self._trial = False
+        self.skipped = 0
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at >= self.cooldown and not self._trial:
+                self._trial = True          # half-open: 한 건만 시험
+                return True
+            self.skipped += 1
+            return False
+
+    def success(self):
+        with self._lock:
+            self._streak = 0
+            self._opened_at = None
+            self._trial = False
+
+    def failure(self):
+        with self._lock:
+            self._streak += 1
+            if self._trial or self._streak >= self.failures:
+                self._opened_at = time.monotonic()
+            self._trial = False
+
+    def state(self) -> dict:
+        with self._lock:
+            if self._opened_at is None:
+                return {"상류": self.name, "상태": "정상", "남은 차단(초)": 0, "건너뜀": self.skipped}
+            left = max(0.0, self.cooldown - (time.monotonic() - self._opened_at))
+            return {"상류": self.name, "상태": "시험 중" if self._trial else "차단",
+                    "남은 차단(초)": round(left), "건너뜀": self.skipped}
+
+@st.cache_resource
+def _circuit_breakers():
+    return {name: CircuitBreaker(name) for name in ("nlk", "openai")}
+
+def circuit_breaker(name) -> CircuitBreaker:
+    return _circuit_breakers()[name]
+
 # 한국 발행지 문자열 → KORMARC 3자리 코드 (필요 시 확장)
 KR_REGION_TO_CODE = {
     "서울": "ulk", "서울특별시": "ulk",
@@ -105,6 +287,38 @@ def build_008_kormarc_bk(
         raise AssertionError(f"008 length != 40: {len(body)}")
     return body
 
+# ⚡ 008 템플릿 엔진 — (입력일자, 06/28/32 고정값) 조합별 40바이트 틀을 한 번만 만들어 두고
+#    레코드마다 가변 위치(07-27, 31, 33-37)만 bytearray 위에서 덮어씁니다. 결과는 build_008_kormarc_bk와 같습니다.
+@functools.lru_cache(maxsize=64)
+def _008_template(date_entered, type_of_date, modified_record, cataloging_src) -> bytes:
+    return build_008_kormarc_bk(
+        date_entered, "    ", "   ", "   ",
+        type_of_date=type_of_date, modified_record=modified_record, cataloging_src=cataloging_src,
+    ).encode("ascii")
+
+def build_008_fast(
+    date_entered, date1, country3, lang3, date2="", illus4="", has_index="0",
+    lit_form=" ", bio=" ", type_of_date="s", modified_record=" ", cataloging_src="a",
+):
+    """build_008_kormarc_bk와 같은 인자·결과, 대량 재생성용 (자리 채우기/자르기는 서식 지정자 '<n.n'으로)"""
+    if len(date1) != 4:
+        raise ValueError("date1은 4자리여야 합니다. 예: '2025', '19uu'")
+    buf = bytearray(_008_template(date_entered, type_of_date or " ", modified_record or " ", cataloging_src or " "))
+    buf[7:22]  = f"{date1}{date2 or '':<4.4}{country3 or '':<3.3}{illus4 or '':<4.4}".encode("ascii", "replace")
+    buf[31]    = 0x31 if has_index == "1" else 0x30
+    buf[33:38] = f"{lit_form or ' ':<1.1}{bio or ' ':<1.1}{lang3 or '':<3.3}".encode("ascii", "replace")
+    return buf.decode("ascii")
+
+# 입력일자(YYMMDD)는 자정까지 같은 값 — 레코드마다 datetime.now()를 부르지 않습니다
+_date_entered_cache = [0.0, ""]     # [다음 자정(epoch), YYMMDD]
+
+def today_yymmdd() -> str:
+    if time.time() >= _date_entered_cache[0]:
+        now = datetime.datetime.now()
+        midnight = datetime.datetime.combine(now.date() + datetime.timedelta(days=1), datetime.time())
+        _date_entered_cache[:] = [midnight.timestamp(), now.strftime("%y%m%d")]
+    return _date_entered_cache[1]
+
 # 발행연도 추출(알라딘 pubDate 우선)
 def extract_year_from_aladin_pubdate(pubdate_str: str) -> str:
     m = re.search(r"(19|20)\d{2}", pubdate_str or "")
@@ -121,36 +335,143 @@ def guess_country3_from_place(place_str: str) -> str:
     return COUNTRY_FIXED
 
 
-# ====== 단어 감지 ======
+# ====== 단어 감지 ====== (정규식은 한 번만 컴파일, 모든 자료유형이 같은 감지 결과를 씁니다)
+_ILLUS_RES = (
+    ("a", re.compile(r"삽화|삽도|도해|일러스트|일러스트레이션|그림|illustration", re.I)),   # 삽화/일러스트/그림
+    ("d", re.compile(r"도표|표|차트|그래프|chart|graph", re.I)),                          # 도표/그래프/차트
+    ("o", re.compile(r"사진|포토|화보|photo|photograph|컬러사진|칼라사진", re.I)),          # 사진/화보
+)
+_INDEX_RE = re.compile(r"색인|찾아보기|인명색인|사항색인|index", re.I)
+_LIT_FORM_RES = (
+    ("i", re.compile(r"서간집|편지|서간문|letters?", re.I)),                 # 서간문학
+    ("m", re.compile(r"기행|여행기|여행 에세이|일기|수기|diary|travel", re.I)),  # 기행/일기/수기
+    ("p", re.compile(r"시집|산문시|poem|poetry", re.I)),                     # 시
+    ("f", re.compile(r"소설|장편|중단편|novel|fiction", re.I)),               # 소설
+    ("e", re.compile(r"에세이|수필|essay", re.I)),                            # 수필
+)
+_BIO_RES = (
+    ("a", re.compile(r"자서전|회고록|autobiograph", re.I)),
+    ("b", re.compile(r"전기|평전|인물 평전|biograph", re.I)),
+    ("d", re.compile(r"전기적|자전적|회고|회상")),
+)
+_ANIMATION_RE = re.compile(r"애니메이션|만화영화|animation", re.I)
+_FREQUENCY_RES = (                  # 계속자료 008/18 간행빈도
+    ("w", re.compile(r"주간")), ("b", re.compile(r"격월")), ("m", re.compile(r"월간")),
+    ("q", re.compile(r"계간")), ("f", re.compile(r"반년간")), ("a", re.compile(r"연간")),
+)
+
+def _first_code(patterns, text, default=" "):
+    for code, rx in patterns:
+        if rx.search(text):
+            return code
+    return default
+
 def detect_illus4(text: str) -> str:
-    # a: 삽화/일러스트/그림, d: 도표/그래프/차트, o: 사진/화보
-    keys = []
-    if re.search(r"삽화|삽도|도해|일러스트|일러스트레이션|그림|illustration", text, re.I): keys.append("a")
-    if re.search(r"도표|표|차트|그래프|chart|graph", text, re.I):                          keys.append("d")
-    if re.search(r"사진|포토|화보|photo|photograph|컬러사진|칼라사진", text, re.I):          keys.append("o")
-    out = []
-    for k in keys:
-        if k not in out:
-            out.append(k)
-    return "".join(out)[:4]
+    return "".join(code for code, rx in _ILLUS_RES if rx.search(text))[:4]
 
 def detect_index(text: str) -> str:
-    return "1" if re.search(r"색인|찾아보기|인명색인|사항색인|index", text, re.I) else "0"
+    return "1" if _INDEX_RE.search(text) else "0"
 
 def detect_lit_form(title: str, category: str, extra_text: str = "") -> str:
-    blob = f"{title} {category} {extra_text}"
-    if re.search(r"서간집|편지|서간문|letters?", blob, re.I): return "i"    # 서간문학
-    if re.search(r"기행|여행기|여행 에세이|일기|수기|diary|travel", blob, re.I): return "m"  # 기행/일기/수기
-    if re.search(r"시집|산문시|poem|poetry", blob, re.I): return "p"        # 시
-    if re.search(r"소설|장편|중단편|novel|fiction", blob, re.I): return "f"  # 소설
-    if re.search(r"에세이|수필|essay", blob, re.I): return "e"               # 수필
-    return " "
+    return _first_code(_LIT_FORM_RES, f"{title} {category} {extra_text}")
 
 def detect_bio(text: str) -> str:
-    if re.search(r"자서전|회고록|autobiograph", text, re.I): return "a"
-    if re.search(r"전기|평전|인물 평전|biograph", text, re.I): return "b"
-    if re.search(r"전기적|자전적|회고|회상", text): return "d"
-    return " "
+    return _first_code(_BIO_RES, text)
+
+def detect_008_features(title: str, category: str, text: str) -> dict:
+    """008 18-34에 쓰일 감지 결과를 한 번에 (자료유형과 무관하게 같은 값)"""
+    return {
+        "illus4":    detect_illus4(text),
+        "has_index": detect_index(text),
+        "lit_form":  detect_lit_form(title, category, text),
+        "bio":       detect_bio(text),
+        "animation": bool(_ANIMATION_RE.search(f"{category} {text}")),
+        "frequency": _first_code(_FREQUENCY_RES, f"{title} {category}", "u"),
+    }
+
+# 🎞️ 자료유형 — 알라딘 mallType(BOOK/FOREIGN/EBOOK/MUSIC/DVD/USED)과 분류명으로 008 배치·007을 고릅니다
+#    00-17(입력일자·날짜유형·발행년·발행국)과 35-39(언어·정부기관부호)는 모든 유형이 같고, 18-34만 유형별입니다.
+_008_LAYOUTS = {
+    # 유형: (007, 008 18-34 바탕 17자)
+    "BK": ("ta", None),                                   # 단행본: build_008_fast
+    "EB": ("cr", None),                                   # 전자책: 단행본 배치 + 23 개별자료형태 'o'(온라인)
+    #        18-21  22  23  24-25  26  27  28  29-34
+    "CF": ("co", "    " " " "q" "  "  "m" " " " " "      "),   # 컴퓨터파일(CD-ROM 등)
+    #        18-19 20  21  22  23  24-29     30-31 32  33  34
+    "MU": ("sd fsngnnmmned", "uu" "n" " " " " " " "      " "  " " " "n" " "),  # 음악 녹음자료(CD)
+    "AU": ("sd fsngnnmmned", "nn" "n" " " " " " " "      " "  " " " "n" " "),  # 음성 녹음자료(오디오북)
+    #        18-20 21  22  23-27   28  29  30-32 33  34
+    "VM": ("vd cvaizq", "---" " " " " "     " " " " " "   " "v" "l"),    # 영상자료(DVD/블루레이)
+    "KT": ("ou",        "nnn" " " " " "     " " " " " "   " "b" "n"),    # 키트(복합매체)
+    #        18  19  20  21  22  23  24  25-27 28  29  30-32 33  34
+    "CR": ("ta", "u" "u" " " "p" " " " " " " "   " " " "0" "   " " " "0"),  # 계속자료(잡지)
+}
+# 키트·소프트웨어는 분류 최상위(매체) 단계에서만 봅니다 — '…>소프트웨어 공학', '…>놀이책>교구' 같은 도서 분류와 구별
+_KIT_RE = re.compile(r"키트|교구|kit", re.I)
+_SOFTWARE_RE = re.compile(r"소프트웨어|CD-?ROM|software", re.I)
+
+def detect_material_format(mall_type: str = "", category: str = "") -> str:
+    mall = (mall_type or "").upper()
+    segments = [seg.strip() for seg in (category or "").split(">")]
+    top = segments[0]
+    if mall == "EBOOK" or top.startswith("eBook"):
+        return "EB"
+    if "오디오북" in segments:
+        return "AU"
+    if mall == "MUSIC" or top.startswith("음반"):
+        return "MU"
+    if mall == "DVD" or top.startswith(("DVD", "블루레이")):
+        return "VM"
+    if len(segments) > 1 and segments[1] == "잡지":
+        return "CR"
+    if _KIT_RE.match(top):
+        return "KT"
+    if _SOFTWARE_RE.match(top):
+        return "CF"
+    return "BK"
+
+def build_007(material: str, category: str = "") -> str:
+    code = _008_LAYOUTS.get(material, _008_LAYOUTS["BK"])[0]
+    if material == "VM" and "블루레이" in (category or ""):
+        code = "vd csaizq"                     # 04 영상 형식 s = 블루레이
+    return code
+
+@functools.lru_cache(maxsize=64)
+def _008_layout_template(material, date_entered, type_of_date) -> bytes:
+    if len(date_entered) != 6 or not date_entered.isdigit():
+        raise ValueError("date_entered는 YYMMDD 6자리 숫자여야 합니다.")
+    body = f"{date_entered}{type_of_date:<1.1}{' ' * 11}{_008_LAYOUTS[material][1]}{' ' * 5}"
+    if len(body) != 40:
+        raise AssertionError(f"008 length != 40: {len(body)}")
+    return body.encode("ascii")
+
+def build_008_material(material, date_entered, date1, country3, lang3, features,
+                       date2="", type_of_date="s", cataloging_src="a"):
+    """자료유형별 008. 단행본·전자책은 build_008_fast, 그 밖은 유형별 틀에 가변 위치만 덮어씁니다."""
+    if material not in _008_LAYOUTS or _008_LAYOUTS[material][1] is None:
+        body = build_008_fast(
+            date_entered, date1, country3, lang3, date2=date2, type_of_date=type_of_date,
+            illus4=features["illus4"], has_index=features["has_index"],
+            lit_form=features["lit_form"], bio=features["bio"], cataloging_src=cataloging_src,
+        )
+        return body[:23] + "o" + body[24:] if material == "EB" else body
+
+    if material == "CR":                  # 계속 간행 중: 날짜유형 c, 종간년 9999
+        type_of_date, date2 = "c", date2 or "9999"
+    if len(date1) != 4:
+        raise ValueError("date1은 4자리여야 합니다. 예: '2025', '19uu'")
+    buf = bytearray(_008_layout_template(material, date_entered, type_of_date))
+    buf[7:18]  = f"{date1}{date2 or '':<4.4}{country3 or '':<3.3}".encode("ascii", "replace")
+    buf[35:38] = f"{lang3 or '':<3.3}".encode("ascii", "replace")
+    if material == "AU":                  # 30-31 녹음 내용(문학 텍스트): f 소설, p 시, a/b 자서전·전기
+        text = features["lit_form"] if features["lit_form"] in ("f", "p") else features["bio"]
+        buf[30:32] = f"{text if text in ('f', 'p', 'a', 'b') else ' ':<2}".encode("ascii")
+    elif material == "VM":                # 34 제작기법: a 애니메이션 / l 실사
+        buf[34] = 0x61 if features["animation"] else 0x6C
+    elif material == "CR":                # 18-19 간행빈도/규칙성
+        freq = features["frequency"]
+        buf[18:20] = f"{freq}{'u' if freq == 'u' else 'r'}".encode("ascii")
+    return buf.decode("ascii")
 
 # 메인: ISBN 하나로 008 생성 (toc/300/041 연동 가능)
 def build_008_from_isbn(
@@ -165,8 +486,10 @@ def build_008_from_isbn(
     override_country3: str = None,   # 외부 모듈이 주면 최우선
     override_lang3: str = None,      # 외부 모듈이 주면 최우선(041)
     cataloging_src: str = "a",       # 32 목록 전거(기본 'a')
+    date_entered: str = None,        # 00-05 YYMMDD (재생성 때 원래 입력일 유지용, 없으면 오늘)
+    material: str = "BK",            # 자료유형(detect_material_format) — 18-34 배치 선택
 ):
-    today  = datetime.datetime.now().strftime("%y%m%d")  # YYMMDD
+    today  = date_entered or today_yymmdd()  # YYMMDD
     date1  = extract_year_from_aladin_pubdate(aladin_pubdate)
 
     # country 우선순위: override > 300발행지 매핑 > 기본값
@@ -182,30 +505,99 @@ def build_008_from_isbn(
 
     # 단어 감지용 텍스트: 제목 + 소개 + 목차
     bigtext = " ".join([aladin_title or "", aladin_desc or "", aladin_toc or ""])
-    illus4    = detect_illus4(bigtext)
-    has_index = detect_index(bigtext)
-    lit_form  = detect_lit_form(aladin_title or "", aladin_category or "", bigtext)
-    bio       = detect_bio(bigtext)
+    features = detect_008_features(aladin_title or "", aladin_category or "", bigtext)
 
-    return build_008_kormarc_bk(
-        date_entered=today,
-        date1=date1,
-        country3=country3,
-        lang3=lang3,
-        illus4=illus4,
-        has_index=has_index,
-        lit_form=lit_form,
-        bio=bio,
-        cataloging_src=cataloging_src,
+    return build_008_material(
+        material, today, date1, country3, lang3, features, cataloging_src=cataloging_src,
     )
 # ========= 008 생성 블록 v3 끝 =========
 
-# 🔍 키워드 추출 (konlpy 없이)
-def extract_keywords_from_text(text, top_n=7):
-    words = re.findall(r'\b[\w가-힣]{2,}\b', text)
-    filtered = [w for w in words if len(w) > 1]
-    freq = Counter(filtered)
-    return [kw for kw, _ in freq.most_common(top_n)]
+# 🔍 키워드 추출 (konlpy 없이) — 로컬 TF-IDF 엔진
+# 조사/어미 사전: 긴 것부터 떼어내야 '으로부터'가 '로'보다 먼저 걸립니다
+KO_JOSA_SUFFIXES = (
+    "으로부터", "에서부터", "에게서", "으로서", "으로써", "이라는", "에서는", "에서도",
+    "에서", "에게", "으로", "부터", "까지", "처럼", "보다", "라는", "이며", "이다", "하는", "하고", "하며", "하여", "하게",
+    "은", "는", "이", "가", "을", "를", "의", "에", "와", "과", "도", "로", "만",
+)
+# 두 글자 이상 조사와 목적격·보조사(을/를/은/는)는 한 글자 어간에서도 뗍니다(꿈을 → 꿈, 한 글자는 뒤에서 버림)
+KO_JOSA_SHORT_STEM = {"을", "를", "은", "는", "에"}
+KO_NO_STRIP = {"어린이", "고양이", "아이", "소설가", "작가", "역사가", "화가", "국가", "평가", "인도", "태도",
+               "토지", "의지", "잡지", "한지", "처지", "광고", "사고", "창고", "보고", "최고", "도서", "문서",
+               "질서", "순서", "정서", "교과서", "보고서", "역사서", "설명서", "아버지", "할아버지", "편지",
+               "돼지", "기지", "대지", "독서", "성서", "사서", "원고", "경고", "신고", "참고", "재고", "학교"}
+# 연결·부정 어미(꾸고/먹지/하며/해서)·관형형(아내였던/평범한)으로 끝나는 토큰은 서술어로 보고 버림
+# (같은 글자로 끝나는 명사는 KO_NO_STRIP에)
+_KO_VERB_ENDING_RE = re.compile(r"[가-힣]+(?:고|지|며|서|던)|[가-힣]{2,}한")
+KEYWORD_STOPWORDS = {
+    "아주", "가지", "필요한", "등", "위해", "것", "수", "더", "이런", "있다", "된다", "한다",
+    "그리고", "하지만", "그러나", "또한", "통해", "대한", "대해", "위한", "모든", "가장", "바로",
+    "우리", "이번", "이제", "함께", "다시", "어떻게", "무엇", "있는", "없는", "같은", "많은",
+    "책은", "이책", "저자", "작가", "독자", "출간", "출판", "소개", "수록", "이야기", "the", "and", "for",
+    "어느", "어떤", "어떠한", "그런", "저런", "이러한", "그러한", "무슨", "여러", "온갖", "각각", "자신",
+    "않기", "되기", "하기", "싶어", "않은", "않는", "위한", "통한", "관한", "다룬", "그녀",
+}
+_KW_TOKEN_RE = re.compile(r"[가-힣]{2,}|[A-Za-z][A-Za-z0-9]{2,}")
+_KW_TAG_RE   = re.compile(r"<[^>]+>")
+
+def _strip_josa(word: str) -> str:
+    if word in KO_NO_STRIP:
+        return word
+    for suf in KO_JOSA_SUFFIXES:
+        min_stem = 1 if len(suf) >= 2 or suf in KO_JOSA_SHORT_STEM else 2
+        if word.endswith(suf) and len(word) - len(suf) >= min_stem:
+            return word[:-len(suf)]
+    return word
+
+def tokenize_ko(text: str) -> list:
+    """제목/소개/목차 문자열 → 조사 뗀 명사 후보 토큰 목록"""
+    text = _KW_TAG_RE.sub(" ", html.unescape(text or ""))
+    out = []
+    for tok in _KW_TOKEN_RE.findall(text):
+        w = _strip_josa(tok.lower())
+        if len(w) >= 3 and w.endswith(("다", "요")):   # 서술어(다룬다/살펴본다) 제외
+            continue
+        if w not in KO_NO_STRIP and _KO_VERB_ENDING_RE.fullmatch(w):
+            continue
+        if len(w) >= 2 and w not in KEYWORD_STOPWORDS:
+            out.append(w)
+    return out
+
+# 문서빈도(DF) 말뭉치: 지금까지 처리한 소개+목차가 쌓입니다 (rerun 사이에도 유지).
+# 재시작 때는 스냅샷에 남은 소개+목차로 다시 채워 빈 말뭉치로 시작하지 않습니다.
+KEYWORD_CORPUS_SEED_DOCS = 20000
+
+@st.cache_resource
+def _keyword_corpus():
+    corpus = {"docs": 0, "df": Counter(), "lock": threading.Lock()}
+    for payload in itertools.islice(_snapshot_store().iter_payloads(), KEYWORD_CORPUS_SEED_DOCS):
+        item = payload.get("aladin") or {}
+        toc = (item.get("subInfo") or {}).get("toc") or item.get("toc") or ""
+        corpus["docs"] += 1
+        corpus["df"].update(set(tokenize_ko(f"{item.get('description', '')} {toc}")))
+    return corpus
+
+def add_to_keyword_corpus(text: str) -> list:
+    tokens = tokenize_ko(text)
+    corpus = _keyword_corpus()
+    with corpus["lock"]:
+        corpus["docs"] += 1
+        corpus["df"].update(set(tokens))
+    return tokens
+
+def extract_keywords_from_text(text, top_n=7, tokens=None):
+    """TF-IDF 상위 키워드. 말뭉치가 비어 있으면 단순 빈도순과 같습니다."""
+    tokens = tokenize_ko(text) if tokens is None else tokens
+    if not tokens:
+        return []
+    corpus = _keyword_corpus()
+    n_docs, df = corpus["docs"], corpus["df"]
+    tf = Counter(tokens)
+    scored = {
+        w: c * (math.log((1 + n_docs) / (1 + df.get(w, 0))) + 1.0)
+        for w, c in tf.items()
+    }
+    ranked = sorted(scored.items(), key=lambda kv: (-kv[1], tokens.index(kv[0])))
+    return [w for w, _ in ranked[:top_n]]
 
 def clean_keywords(words):
     stopwords = {"아주", "가지", "필요한", "등", "위해", "것", "수", "더", "이런", "있다", "된다", "한다"}
@@ -222,7 +614,13 @@ def extract_category_keywords(category_str):
     return list(keywords)
 
 # 🔧 GPT 기반 KDC 추천 (OpenAI 1.6.0+ 방식으로 리팩토링)
+_KDC_RE      = re.compile(r"KDC:\s*(\d{3}(?:\.\d+)?)")
+_KDC_DONE_RE = re.compile(r"KDC:\s*(\d{3}(?:\.\d+)?)(?=[^\d.]|\.[^\d])")   # 뒤에 숫자가 더 올 수 없을 때
+
 def recommend_kdc(title, author, api_key):
+    breaker = circuit_breaker("openai")
+    if not breaker.allow():
+        return "000"            # 차단 중: 056 없이 내고 나중에 보강
     try:
         # 🔑 비밀의 열쇠로 클라이언트를 깨웁니다
         client = OpenAI(api_key=api_key)
@@ -236,26 +634,37 @@ def recommend_kdc(title, author, api_key):
             "KDC: 813.7"
         )
 
-        # 🧠 GPT의 지혜를 소환
-        response = client.chat.completions.create(
-            model="gpt-4",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.3,
-        )
-
-        # ← 여기부터 보강된 부분
-        msg = response.choices[0].message
-        content = getattr(msg, "content", None)
-        if content is None and isinstance(msg, dict):
-            content = msg.get("content", "")
-        content = content or ""
-
-        # ✂️ “KDC:” 뒤의 숫자만 꺼내서 돌려드립니다
+        # 🧠 GPT의 지혜를 스트리밍으로 소환 — 'KDC: nnn.n'이 완성되는 즉시 끊습니다
+        with pipeline_stats().track("openai"):      # 첫 응답까지(요금 제한 시 여기서 늘어남)
+            stream = client.chat.completions.create(
+                model="gpt-4",
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0.3,
+                stream=True,
+            )
+        breaker.success()
+        content = ""
+        try:
+            for chunk in stream:
+                if not chunk.choices:
+                    continue
+                content += chunk.choices[0].delta.content or ""
+                m = _KDC_DONE_RE.search(content)
+                if m:
+                    return m.group(1)
+        finally:
+            stream.close()
+
+        # ✂️ 스트림이 숫자로 끝난 경우: “KDC:” 뒤의 숫자만 꺼내서 돌려드립니다
+        m = _KDC_RE.search(content)
+        if m:
+            return m.group(1)
         for line in content.splitlines():
             if "KDC:" in line:
                 return line.split("KDC:")[1].strip()
 
     except Exception as e:
+        breaker.failure()
         st.warning(f"🧠 GPT 오류: {e}")
 
     # 🛡️ 만약 실패하면 디폴트 “000”
@@ -263,22 +672,46 @@ def recommend_kdc(title, author, api_key):
 
 
 # 📡 부가기호 추출 (국립중앙도서관)
-@st.cache_data(ttl=24*3600)
-def fetch_additional_code_from_nlk(isbn: str) -> str:
+class UpstreamBlocked(Exception):
+    """회로 차단기가 열려 있어 호출하지 않음"""
+
+def _nlk_doc_fetch(isbn: str) -> dict:
+    """실패는 예외로 올려 캐시에 남기지 않습니다(다음 호출에서 다시 시도)."""
+    breaker = circuit_breaker("nlk")
+    if not breaker.allow():
+        raise UpstreamBlocked("nlk")
     url = (
         f"https://www.nl.go.kr/seoji/SearchApi.do?"
         f"cert_key={nlk_key}&result_style=xml"
         f"&page_no=1&page_size=1&isbn={isbn}"
     )
     try:
-        res = _nlk_session.get(url, timeout=3)  # 3초만 기다리고
-        res.raise_for_status()
-        root = ET.fromstring(res.text)
-        doc  = root.find('.//docs/e')
-        return (doc.findtext('EA_ADD_CODE') or "").strip() if doc is not None else ""
+        with pipeline_stats().track("nlk"):
+            res = hedged_get("www.nl.go.kr", _nlk_session.get, url, timeout=3)  # 3초만 기다리고
+            res.raise_for_status()
+            root = ET.fromstring(res.text)
+    except Exception:
+        breaker.failure()
+        raise
+    breaker.success()
+    doc = root.find('.//docs/e')
+    return {el.tag: (el.text or "").strip() for el in doc} if doc is not None else {}
+
+def fetch_nlk_doc(isbn: str):
+    """서지정보 검색 응답의 첫 문서(docs/e)를 {태그: 값}으로.
+    검색 결과가 없으면 빈 dict, 지연·오류·차단으로 못 받았으면 None(나중에 보강 대상).
+    캐시에 있으면 오래됐어도 바로 돌려주고 새로 고침은 뒤에서 합니다."""
+    try:
+        return metadata_cache().get("nlk", str(isbn).strip(), _nlk_doc_fetch)
+    except UpstreamBlocked:
+        return None
     except Exception:
         st.warning("⚠️ 국중API 지연, 부가기호는 생략합니다.")
-        return ""
+        return None
+
+def fetch_additional_code_from_nlk(isbn: str) -> str:
+    doc = fetch_nlk_doc(isbn) or {}
+    return doc.get("EA_ADD_CODE") or doc.get("ADDCODE", "")
 
 
 # 🔤 언어 감지 및 041, 546 생성
@@ -288,31 +721,85 @@ ISDS_LANGUAGE_CODES = {
     'und': '알 수 없음'
 }
 
+# 문자 체계 구간표 — 코드포인트를 bisect로 찾습니다
+_SCRIPT_RANGES = (
+    (0x0041, 0x005A, "latin"), (0x0061, 0x007A, "latin"), (0x00C0, 0x024F, "latin"),
+    (0x0400, 0x04FF, "cyrillic"), (0x0600, 0x06FF, "arabic"), (0x1100, 0x11FF, "hangul"),
+    (0x3040, 0x30FF, "kana"), (0x3130, 0x318F, "hangul"), (0x3400, 0x4DBF, "han"),
+    (0x4E00, 0x9FFF, "han"), (0xAC00, 0xD7A3, "hangul"), (0xFF66, 0xFF9F, "kana"),
+)
+_SCRIPT_STARTS = [lo for lo, _, _ in _SCRIPT_RANGES]
+_SCRIPT_TO_LANG = {"hangul": "kor", "kana": "jpn", "han": "chi", "cyrillic": "rus", "arabic": "ara"}
+
+# 라틴 문자 언어: 자주 나오는 글자 3-gram(단어 경계 '_') + 특징 문자
+_LATIN_PROFILES = {
+    "eng": ("_th", "the", "he_", "and", "nd_", "_an", "ing", "ng_", "_of", "of_", "ion", "_to",
+            "to_", "ed_", "_in", "er_", "_wh", "ght", "_is", "ly_"),
+    "fre": ("_le", "le_", "_de", "de_", "es_", "_la", "la_", "les", "_et", "et_", "que", "ue_",
+            "des", "_du", "du_", "eur", "_un", "_po", "ois", "ux_"),
+    "ger": ("en_", "er_", "der", "_de", "die", "_di", "ie_", "und", "_un", "nd_", "ein", "_ei",
+            "sch", "ich", "che", "cht", "ung", "den", "_zu", "_da"),
+    "ita": ("_di", "di_", "_il", "il_", "_la", "la_", "_de", "del", "ell", "lla", "_ch", "che",
+            "one", "zio", "_co", "to_", "no_", "_un", "gli", "_pe"),
+    "spa": ("_de", "de_", "_la", "la_", "_el", "el_", "os_", "que", "_qu", "ue_", "_en", "en_",
+            "del", "ión", "ció", "as_", "_lo", "los", "ado", "_y_"),
+}
+_LATIN_MARKS = {"fre": "éèêçœàù", "ger": "äöüß", "ita": "ìòà", "spa": "ñáíóú¿¡"}
+_LATIN_WORD_RE = re.compile(r"[^\W\d_]+")
+
+def script_histogram(text: str) -> Counter:
+    """글자를 한 번 세고(Counter), 서로 다른 글자만 문자 체계로 분류합니다."""
+    hist = Counter()
+    for ch, n in Counter(text or "").items():
+        cp = ord(ch)
+        i = bisect.bisect_right(_SCRIPT_STARTS, cp) - 1
+        if i >= 0 and cp <= _SCRIPT_RANGES[i][1]:
+            hist[_SCRIPT_RANGES[i][2]] += n
+    return hist
+
+def _latin_language(text: str) -> str:
+    words = _LATIN_WORD_RE.findall((text or "").lower())
+    grams = Counter(g for w in words for p in (f"_{w}_",) for g in (p[i:i + 3] for i in range(len(p) - 2)))
+    total = sum(grams.values()) or 1
+    scores = {
+        lang: sum(grams[g] for g in profile) / total
+        + sum(text.count(c) for c in _LATIN_MARKS.get(lang, "")) * 0.05
+        for lang, profile in _LATIN_PROFILES.items()
+    }
+    best = max(scores, key=scores.get)
+    return best if scores[best] > 0 else "eng"
+
+def language_from_histogram(hist: Counter, text: str = "") -> str:
+    if not hist:
+        return "und"
+    cjk = hist["kana"] + hist["han"]
+    if hist["kana"] and hist["kana"] * 10 >= cjk and cjk > hist["hangul"]:
+        return "jpn"                          # 일본어는 가나가 섞여 있으면 한자가 더 많아도 일본어
+    script = hist.most_common(1)[0][0]
+    return _latin_language(text) if script == "latin" else _SCRIPT_TO_LANG[script]
+
 def detect_language(text):
-    text = re.sub(r'[\s\W_]+', '', text)
-    if not text:
-        return 'und'
-    first_char = text[0]
-    if '\uac00' <= first_char <= '\ud7a3':
-        return 'kor'
-    elif '\u3040' <= first_char <= '\u30ff':
-        return 'jpn'
-    elif '\u4e00' <= first_char <= '\u9fff':
-        return 'chi'
-    elif '\u0400' <= first_char <= '\u04FF':
-        return 'rus'
-    elif 'a' <= first_char.lower() <= 'z':
-        return 'eng'
-    else:
-        return 'und'
+    text = _KW_TAG_RE.sub(" ", text or "")
+    return language_from_histogram(script_histogram(text), text)
+
+@functools.lru_cache(maxsize=20000)
+def detect_record_languages(isbn, title, original_title="", description="") -> tuple:
+    """ISBN별 (본문 언어, 원저 언어 또는 '') — 041 $a/$h, 546, 008/35-37이 이 한 번의 결과를 씁니다.
+    본문 언어는 서명+소개를 합친 히스토그램, 원저 언어는 원제에서 봅니다."""
+    body = _KW_TAG_RE.sub(" ", f"{title} {description}")
+    lang_a = language_from_histogram(script_histogram(body), body)
+    lang_h = detect_language(original_title) if original_title else ""
+    return lang_a, (lang_h if lang_h not in (lang_a, "und") else "")
+
+_041_SUBFIELD_RE = re.compile(r"\$([ah])([a-z]{3})")
 
 def generate_546_from_041_kormarc(marc_041: str) -> str:
     a_codes, h_code = [], None
-    for part in marc_041.split():
-        if part.startswith("$a"):
-            a_codes.append(part[2:])
-        elif part.startswith("$h"):
-            h_code = part[2:]
+    for code, lang in _041_SUBFIELD_RE.findall(marc_041):
+        if code == "a":
+            a_codes.append(lang)
+        else:
+            h_code = lang
     if len(a_codes) == 1:
         a_lang = ISDS_LANGUAGE_CODES.get(a_codes[0], "알 수 없음")
         if h_code:
@@ -325,37 +812,79 @@ def generate_546_from_041_kormarc(marc_041: str) -> str:
         return f"{'、'.join(langs)} 병기"
     return "언어 정보 없음"
 
+# 🕸️ 알라딘 상품 페이지에서 원제·정가만 뽑기 (스트리밍 + 정규식, ISBN별 캐시)
+_CRAWL_ORIGINAL_RE = re.compile(rb'<div[^>]*class="[^"]*\binfo_original\b[^"]*"[^>]*>(.*?)</div>', re.S)
+_CRAWL_PRICE_RE    = re.compile(rb'<span[^>]*class="[^"]*\bprice2\b[^"]*"[^>]*>(.*?)</span>', re.S)
+_CRAWL_CHUNK       = 16 * 1024
+_CRAWL_AFTER_PRICE = 64 * 1024      # 정가 뒤로 이만큼 더 읽어도 원제가 없으면 번역서가 아닌 것으로 봄
+_CRAWL_MAX_BYTES   = 512 * 1024
+
+def _crawl_text(raw: bytes) -> str:
+    text = _KW_TAG_RE.sub(" ", html.unescape(raw.decode("utf-8", "ignore")))
+    return _NORM_SPACE_RE.sub(" ", text).strip()
+
 def crawl_aladin_original_and_price(isbn13):
-    url = f"https://www.aladin.co.kr/shop/wproduct.aspx?ISBN={isbn13}"
-    headers = {"User-Agent": "Mozilla/5.0"}
+    """원제·정가 (메타데이터 캐시 'page'에 영구 저장, 오래되면 뒤에서 새로 고침). 실패하면 빈 dict"""
     try:
-        res = requests.get(url, headers=headers, timeout=10)
-        soup = BeautifulSoup(res.text, "html.parser")
-        original = soup.select_one("div.info_original")
-        price = soup.select_one("span.price2")
-        return {
-            "original_title": original.text.strip() if original else "",
-            "price": price.text.strip().replace("정가 : ", "").replace("원", "").replace(",", "").strip() if price else ""
-        }
-    except:
+        return metadata_cache().get("page", str(isbn13).strip(), _page_fetch)
+    except Exception:
         return {}
 
+def _page_fetch(isbn13):
+    """실패는 예외로 올려 캐시에 남기지 않습니다."""
+    url = f"https://www.aladin.co.kr/shop/wproduct.aspx?ISBN={isbn13}"
+    headers = {"User-Agent": "Mozilla/5.0"}
+    original = price = None
+    price_at = None
+    buf = b""
+    with pipeline_stats().track("crawl"), requests.get(url, headers=headers, timeout=10, stream=True) as res:
+        res.raise_for_status()
+        for chunk in res.iter_content(chunk_size=_CRAWL_CHUNK):
+            buf += chunk
+            if original is None:
+                m = _CRAWL_ORIGINAL_RE.search(buf)
+                original = m.group(1) if m else None
+            if price is None:
+                m = _CRAWL_PRICE_RE.search(buf)
+                if m:
+                    price, price_at = m.group(1), len(buf)
+            if original is not None and price is not None:
+                break
+            if price_at is not None and len(buf) - price_at > _CRAWL_AFTER_PRICE:
+                break
+            if len(buf) > _CRAWL_MAX_BYTES:
+                break
+
+    original_title = _crawl_text(original) if original is not None else ""
+    original_title = re.sub(r"^원제\s*:?\s*", "", original_title)
+    original_title = re.sub(r"\s*\(\d{4}년?\)\s*$", "", original_title)
+    price_text = _crawl_text(price) if price is not None else ""
+    return {
+        "original_title": original_title,
+        "original_lang": detect_language(original_title) if original_title else "und",   # 041 $h용(한 번만 감지)
+        "price": price_text.replace("정가 : ", "").replace("원", "").replace(",", "").strip(),
+    }
+
 # ---- 653 전처리 유틸 ----
+_NORM_PUNCT_RE  = re.compile(r"[^\w\s\uac00-\ud7a3]")   # 한/영/숫자/공백만
+_NORM_SPACE_RE  = re.compile(r"\s+")
+_AUTHOR_ROLE_RE = re.compile(r"\(.*?\)")
+_AUTHOR_SEP_RE  = re.compile(r"[/;·,]")
+
+@functools.lru_cache(maxsize=65536)
 def _norm(text: str) -> str:
-    import re, unicodedata
     if not text:
         return ""
     text = unicodedata.normalize("NFKC", text).lower()
-    text = re.sub(r"[^\w\s\uac00-\ud7a3]", " ", text)  # 한/영/숫자/공백만
-    return re.sub(r"\s+", " ", text).strip()
+    text = _NORM_PUNCT_RE.sub(" ", text)
+    return _NORM_SPACE_RE.sub(" ", text).strip()
 
 def _clean_author_str(s: str) -> str:
-    import re
     if not s:
         return ""
-    s = re.sub(r"\(.*?\)", " ", s)      # (지은이), (옮긴이) 등 제거
-    s = re.sub(r"[/;·,]", " ", s)       # 구분자 공백화
-    return re.sub(r"\s+", " ", s).strip()
+    s = _AUTHOR_ROLE_RE.sub(" ", s)      # (지은이), (옮긴이) 등 제거
+    s = _AUTHOR_SEP_RE.sub(" ", s)       # 구분자 공백화
+    return _NORM_SPACE_RE.sub(" ", s).strip()
 
 def _build_forbidden_set(title: str, authors: str) -> set:
     t_norm = _norm(title)
@@ -369,47 +898,203 @@ def _build_forbidden_set(title: str, authors: str) -> set:
         forb.add(a_norm.replace(" ", ""))
     return {f for f in forb if f and len(f) >= 2}  # 1글자 제거
 
-def _should_keep_keyword(kw: str, forbidden: set) -> bool:
+
+class ForbiddenIndex:
+    """레코드별 제외어 색인(정규화된 제외어로 한 번만 만듭니다).
+
+    - `tok in n` : 제외어 길이별로 n의 해당 길이 조각만 잘라 집합에서 O(1) 조회
+    - `n in tok` : 제외어들을 구분자(\x00)로 이은 문자열에서 부분문자열 검사 한 번
+    기존 이중 루프(`for tok in forbidden`)와 판정 결과가 같습니다.
+    """
+
+    __slots__ = ("tokens", "_lengths", "_haystack")
+
+    def __init__(self, forbidden):
+        self.tokens = frozenset(forbidden)
+        self._lengths = sorted({len(t) for t in self.tokens})
+        self._haystack = "\x00" + "\x00".join(self.tokens) + "\x00"
+
+    def blocks(self, n: str) -> bool:
+        """정규화된 키워드 n이 제외어와 부분일치하면 True"""
+        if not self.tokens:
+            return False
+        if n in self._haystack:
+            return True
+        tokens, size = self.tokens, len(n)
+        for L in self._lengths:
+            if L > size:
+                break
+            for i in range(size - L + 1):
+                if n[i:i + L] in tokens:
+                    return True
+        return False
+
+
+@functools.lru_cache(maxsize=1024)
+def _build_forbidden_index(title: str, authors: str) -> ForbiddenIndex:
+    return ForbiddenIndex(_build_forbidden_set(title, authors))
+
+def _should_keep_keyword(kw: str, forbidden) -> bool:
     n = _norm(kw)
     if not n or len(n.replace(" ", "")) < 2:
         return False
-    for tok in forbidden:
-        if tok in n or n in tok:
-            return False
-    return True
+    if not isinstance(forbidden, ForbiddenIndex):
+        forbidden = ForbiddenIndex(forbidden)
+    return not forbidden.blocks(n)
+
+def filter_keywords(kws, forbidden: ForbiddenIndex) -> list:
+    """후보 키워드 전체를 색인 하나로 한 번에 거릅니다(정규화 중복 제거 포함)."""
+    out, seen = [], set()
+    for kw in kws:
+        n = _norm(kw)
+        if n in seen or len(n.replace(" ", "")) < 2 or forbidden.blocks(n):
+            continue
+        seen.add(n)
+        out.append(kw)
+    return out
 # -------------------------
 
+# 👤 저자·기여자 파싱 — 알라딘 "A, B (지은이), C (옮긴이)" / 국중 "지은이: A, B ; 옮긴이: C"
+#    한 번 파싱한 결과로 245 $d/$e, 100, 700을 모두 만듭니다.
+CONTRIBUTOR_ROLES = {
+    # 역할 표시: (관계 코드, 245 책임표시 낱말)
+    "지은이": ("aut", "지음"), "저자": ("aut", "지음"), "지음": ("aut", "지음"), "글": ("aut", "글"),
+    "원작": ("aut", "원작"), "옮긴이": ("trl", "옮김"), "역자": ("trl", "옮김"), "번역": ("trl", "옮김"),
+    "옮김": ("trl", "옮김"), "편역": ("trl", "편역"), "그림": ("ill", "그림"), "그린이": ("ill", "그림"),
+    "사진": ("pht", "사진"), "엮은이": ("edt", "엮음"), "편저": ("edt", "편저"), "편집": ("edt", "엮음"),
+    "감수": ("ctb", "감수"), "해설": ("ctb", "해설"),
+}
+Contributor = namedtuple("Contributor", "name heading role term")
+
+_CONTRIB_ALADIN_RE = re.compile(r"\s*([^,;/()]*?)\s*(?:\(([^)]*)\))?\s*(?:[,;/]|$)")   # 구분자: , ; /
+_CONTRIB_NLK_RE    = re.compile(r"([^;:]+?)\s*:\s*([^;]+)")
+_CONTRIB_ETAL_RE   = re.compile(r"\s*(?:외|등)\s*\d*\s*(?:인|명)?$")
+
+@functools.lru_cache(maxsize=65536)
+def name_heading(name: str) -> str:
+    """표목형: 띄어 쓴 이름(주로 외국인)은 '성, 이름'으로 도치, 붙여 쓴 한국 이름은 그대로"""
+    parts = name.split()
+    return f"{parts[-1]}, {' '.join(parts[:-1])}" if len(parts) >= 2 else name
+
+def _contributor(name, role_text):
+    name = _CONTRIB_ETAL_RE.sub("", _NORM_SPACE_RE.sub(" ", name)).strip()
+    if not name:
+        return None
+    role, term = CONTRIBUTOR_ROLES.get((role_text or "").strip(), ("aut", "지음"))
+    return Contributor(name, name_heading(name), role, term)
+
+@functools.lru_cache(maxsize=20000)
+def parse_contributors(author_str: str) -> tuple:
+    """저자 문자열 → Contributor 튜플(등장 순서, 중복 제거). 역할이 없는 이름은 다음 역할 표시를 따릅니다."""
+    author_str = (author_str or "").strip()
+    found = []
+    if ":" in author_str and "(" not in author_str:                 # 국중 서지 형식
+        for role_text, names in _CONTRIB_NLK_RE.findall(author_str):
+            found += [_contributor(n, role_text) for n in names.split(",")]
+    else:
+        pending = []
+        for m in _CONTRIB_ALADIN_RE.finditer(author_str):
+            name, role_text = m.group(1), m.group(2)
+            if name:
+                pending.append(name)
+            if role_text is not None:
+                found += [_contributor(n, role_text) for n in pending]
+                pending = []
+            if m.end() >= len(author_str):
+                break
+        found += [_contributor(n, "") for n in pending]
+    seen, out = set(), []
+    for c in found:
+        if c is not None and (c.name, c.role) not in seen:
+            seen.add((c.name, c.role))
+            out.append(c)
+    return tuple(out)
+
+def build_245_responsibility(contributors) -> str:
+    """'$d박경리 지음 ;$e김철수 옮김' — 첫 이름만 $d, 나머지는 $e. 같은 역할은 쉼표로 묶습니다."""
+    groups = {}
+    for c in contributors:
+        groups.setdefault(c.term, []).append(c.name)
+    parts, first = [], True
+    for term, names in groups.items():
+        marked = []
+        for name in names:
+            marked.append(f"${'d' if first else 'e'}{name}")
+            first = False
+        parts.append(f"{', '.join(marked)} {term}")
+    return " ;".join(parts)
+
+def build_100_700(contributors, authority=None) -> tuple:
+    """(100 줄 또는 '', 700 줄 목록). 100은 첫 저자, 나머지 기여자는 700 (표목은 전거 색인 기준)"""
+    index = authority or authority_index()
+    headings = [index.heading("name", c.heading) for c in contributors]      # 전거 표목으로 통일
+    main = next((i for i, c in enumerate(contributors) if c.role == "aut"), None)
+    line_100 = f"=100  1\\$a{headings[main]}" if main is not None else ""
+    lines_700 = [f"=700  1\\$a{h}" for i, h in enumerate(headings)
+                 if i != main and (main is None or h != headings[main])]
+    return line_100, list(dict.fromkeys(lines_700))
+
 # 📄 653 필드 키워드 생성
-# ② 알라딘 메타데이터 호출 함수
+# ② 알라딘 메타데이터 호출 함수 — ItemLookUp 단일 클라이언트
+#    008/041/245/653/KDC가 모두 이 한 번의 응답(필요한 OptResult 전부 포함)을 나눠 씁니다.
+ALADIN_LOOKUP_URL = "https://www.aladin.co.kr/ttb/api/ItemLookUp.aspx"
+ALADIN_OPT_RESULT = "Toc,Story,packing"     # subInfo.toc / 소개 / 판형 (originalTitle·subTitle은 기본 포함)
+
+def _aladin_item_fetch(isbn):
+    params = {
+        "ttbkey": aladin_key, "itemIdType": "ISBN", "ItemId": isbn,
+        "output": "js", "Version": "20131101", "OptResult": ALADIN_OPT_RESULT,
+    }
+    with pipeline_stats().track("aladin"):
+        resp = hedged_get("www.aladin.co.kr", requests.get, ALADIN_LOOKUP_URL,
+                          params=params, verify=False, timeout=5)
+        resp.raise_for_status()
+        data = resp.json()
+    if data.get("errorCode") or not data.get("item"):       # 쿼터 초과 등 오류 응답은 빈 값으로 캐시하지 않음
+        raise RuntimeError(f"알라딘 오류 응답 {data.get('errorCode', '')}: {data.get('errorMessage', 'item 없음')}")
+    return data["item"][0]
+
+def lookup_aladin_item(isbn):
+    """ISBN당 원본 item(dict). 메타데이터 캐시(stale-while-revalidate)를 거치며,
+    여러 생성기가 공유하므로 수정하지 마세요."""
+    return metadata_cache().get("aladin", str(isbn).strip(), _aladin_item_fetch)
+
 def fetch_aladin_metadata(isbn):
-    url = (
-        "http://www.aladin.co.kr/ttb/api/ItemLookUp.aspx"
-        f"?ttbkey={aladin_key}"
-        "&ItemIdType=ISBN"
-        f"&ItemId={isbn}"
-        "&output=js"
-        "&Version=20131101"
-        "&OptResult=Toc"
-    )
-    data = requests.get(url).json()
-    item = (data.get("item") or [{}])[0]
+    """lookup_aladin_item 응답을 생성기들이 쓰는 필드로 풀어 둔 읽기 전용 뷰"""
+    return parse_aladin_item(isbn, lookup_aladin_item(isbn))
+
+def parse_aladin_item(isbn, item):
+    sub = item.get("subInfo") or {}
+    series = item.get("seriesInfo") or {}
 
     # 저자 필드 다양한 키 대응
     raw_author = item.get("author") or item.get("authors") or item.get("author_t") or ""
-    authors = _clean_author_str(raw_author)
 
-    return {
+    return types.MappingProxyType({
+        "isbn": str(isbn).strip(),
         "category": item.get("categoryName", "") or "",
         "title": item.get("title", "") or "",
-        "authors": authors,                           # ⬅️ 추가됨
+        "author": raw_author,
+        "authors": _clean_author_str(raw_author),     # ⬅️ 653 제외어용
+        "publisher": item.get("publisher", "") or "",
+        "pubdate": item.get("pubDate", "") or "",
         "description": item.get("description", "") or "",
-        "toc": item.get("toc", "") or "",
-    }
+        "toc": sub.get("toc") or item.get("toc") or "",
+        "price": str(item.get("priceStandard", "") or ""),
+        "mall_type": item.get("mallType", "") or "",
+        "original_title": (sub.get("originalTitle") or "").strip(),
+        "series_name": (series.get("seriesName") or "").strip(),
+        "volume": str(series.get("volume") or "").strip(),
+        "item": item,
+    })
+
 
 
+# ③ GPT-4 기반 653 생성 함수 (스트리밍: on_partial(키워드목록)으로 중간 결과 전달)
+_653_RE      = re.compile(r"\$a(.*?)(?=(?:\$a|$))", re.DOTALL)
+_653_DONE_RE = re.compile(r"\$a([^$]*?)(?=\$a)")
 
-# ③ GPT-4 기반 653 생성 함수
-def generate_653_with_gpt(category, title, authors, description, toc, max_keywords=7):
+def generate_653_with_gpt(category, title, authors, description, toc, max_keywords=7, on_partial=None):
     parts = [p.strip() for p in (category or "").split(">") if p.strip()]
     cat_kw = parts[-1] if parts else ""
 
@@ -440,18 +1125,37 @@ def generate_653_with_gpt(category, title, authors, description, toc, max_keywor
             "3) 출력 형식: $a키워드1 $a키워드2 … (한 줄)\n"
         )
     }
+    breaker = circuit_breaker("openai")
+    if not breaker.allow():
+        return None             # 차단 중: 로컬 추출로 대체하고 나중에 보강
     try:
-        resp = gpt_client.chat.completions.create(
-            model="gpt-4",
-            messages=[system_msg, user_msg],
-            temperature=0.2,
-            max_tokens=180,
-        )
-        raw = (resp.choices[0].message.content or "").strip()
+        with pipeline_stats().track("openai"):
+            stream = gpt_client.chat.completions.create(
+                model="gpt-4",
+                messages=[system_msg, user_msg],
+                temperature=0.2,
+                max_tokens=180,
+                stream=True,
+            )
+        breaker.success()
+        raw, shown = "", []
+        index = _build_forbidden_index(title, authors)
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            raw += chunk.choices[0].delta.content or ""
+            if on_partial is None:
+                continue
+            # 뒤에 다음 $a가 붙어 완성된 키워드만 먼저 보여 줍니다
+            done = [m.group(1).strip().replace(" ", "") for m in _653_DONE_RE.finditer(raw)]
+            partial = filter_keywords(done, index)[:max_keywords]
+            if partial != shown:
+                shown = partial
+                on_partial(partial)
+        raw = raw.strip()
 
         # $a 단위 파싱
-        pattern = re.compile(r"\$a(.*?)(?=(?:\$a|$))", re.DOTALL)
-        kws = [m.group(1).strip() for m in pattern.finditer(raw)]
+        kws = [m.group(1).strip() for m in _653_RE.finditer(raw)]
         if not kws:
             # 백업 파싱
             tmp = re.split(r"[,\n]", raw)
@@ -460,17 +1164,8 @@ def generate_653_with_gpt(category, title, authors, description, toc, max_keywor
         # 공백 삭제(원하면 유지 가능)
         kws = [kw.replace(" ", "") for kw in kws]
 
-        # 1차: 금칙어(서명/저자) 필터
-        kws = [kw for kw in kws if _should_keep_keyword(kw, forbidden)]
-
-        # 2차: 정규화 중복 제거
-        seen = set()
-        uniq = []
-        for kw in kws:
-            n = _norm(kw)
-            if n not in seen:
-                seen.add(n)
-                uniq.append(kw)
+        # 1차: 금칙어(서명/저자) 필터 + 2차: 정규화 중복 제거 (색인 한 번으로)
+        uniq = filter_keywords(kws, index)
 
         # 3차: 최대 개수 제한
         uniq = uniq[:max_keywords]
@@ -478,48 +1173,975 @@ def generate_653_with_gpt(category, title, authors, description, toc, max_keywor
         return "".join(f"$a{kw}" for kw in uniq)
 
     except Exception as e:
+        breaker.failure()
         st.warning(f"⚠️ 653 주제어 생성 실패: {e}")
         return None
    
 
 
-# 📚 MARC 생성
-@st.cache_data(show_spinner=False)
-def fetch_book_data_from_aladin(isbn, reg_mark="", reg_no="", copy_symbol=""):
-    import re
-    from concurrent.futures import ThreadPoolExecutor
+# ④ 로컬 653 생성 함수 (GPT 실패 시 대체 / 오프라인 모드)
+def generate_653_local(category, title, authors, description, toc, max_keywords=7, tokens=None):
+    parts = [p.strip() for p in (category or "").split(">") if p.strip()]
+    cat_tokens = tokenize_ko(parts[-1]) if parts else []
+
+    if tokens is None:
+        tokens = tokenize_ko(f"{description or ''} {toc or ''}")
+    candidates = extract_keywords_from_text("", top_n=max_keywords * 3, tokens=tokens)
+
+    uniq = filter_keywords(clean_keywords(cat_tokens + candidates),
+                           _build_forbidden_index(title, authors))[:max_keywords]
+    return "".join(f"$a{kw}" for kw in uniq) or None
+
+
+# 🧬 보강(KDC/653) 결과 캐시 — 판본·양장/반양장·다권본 등 근사 중복 재사용
+CACHE_DIR = os.environ.get("ISBN2MARC_CACHE_DIR", ".cache")
+SIMHASH_BITS = 64
+SIMHASH_BANDS = 4                 # 16비트 x 4 밴드 → 해밍거리 3 이하는 반드시 한 밴드가 일치
+SIMHASH_MAX_DISTANCE = 3          #   (밴드당 후보는 대략 표의 1/65536 — 8비트 밴드는 1/256씩 끌려와 표 전체를 훑는 셈)
+SIMHASH_CANDIDATE_LIMIT = 200     # 지문이 쏠린 경우(짧은 상투적 소개 등)에도 해밍거리 계산은 최근 후보 이만큼만
+SIMHASH_MIN_TEXT = 20             # 정규화 후 이보다 짧으면(제목뿐인 경우 등) 캐시하지 않음
+
+@st.cache_resource
+def _cache_db():
+    """보강/메타데이터 캐시용 SQLite (프로세스 전체 공유, rerun 사이 유지)"""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    conn = sqlite3.connect(os.path.join(CACHE_DIR, "isbn2marc.sqlite"), check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return {"conn": conn, "lock": threading.RLock()}
+
+# 🔁 메타데이터 캐시 — stale-while-revalidate
+#    필드별 신선 기간 안이면 그대로, 지났으면 캐시 값을 바로 주고 뒤에서 새로 받습니다.
+#    값에 들어 있는 필드 중 가장 짧은 기간이 그 항목의 신선 기간입니다(빈 응답은 _empty).
+DAY = 24 * 3600
+METADATA_POLICIES = {
+    "aladin": {"priceStandard": 7 * DAY, "seriesInfo": 30 * DAY, "_empty": 1 * DAY, "_default": 30 * DAY},
+    "nlk": {"PRE_PRICE": 7 * DAY, "EA_ADD_CODE": 90 * DAY, "SET_ADD_CODE": 90 * DAY,
+            "_empty": 1 * DAY, "_default": 90 * DAY},
+    "page": {"price": 7 * DAY, "_empty": 1 * DAY, "_default": 30 * DAY},      # 상품 페이지 원제·정가
+}
+METADATA_MAX_AGE = 365 * DAY      # 이보다 오래된 값은 기다려서 새로 받음(실패하면 그래도 옛 값)
+METADATA_MEMORY_ENTRIES = 20000
+
+def fresh_for(source, value) -> float:
+    policy = METADATA_POLICIES[source]
+    if not value:
+        return policy["_empty"]
+    spans = [sec for field, sec in policy.items() if not field.startswith("_") and value.get(field)]
+    return min(spans, default=policy["_default"])
+
+class MetadataCache:
+    """_cache_db() 안의 metadata 테이블 + 프로세스 메모리 앞단"""
+
+    def __init__(self, db):
+        self.conn, self.lock = db["conn"], db["lock"]
+        with self.lock:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS metadata ("
+                " source TEXT, key TEXT, payload BLOB, fetched_at REAL, PRIMARY KEY (source, key))"
+            )
+            self.conn.commit()
+        self._mem = {}
+        self._inflight = set()
+        self.counts = Counter()
+
+    def _load(self, source, key):
+        entry = self._mem.get((source, key))
+        if entry is not None:
+            return entry
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT payload, fetched_at FROM metadata WHERE source=? AND key=?", (source, key)
+            ).fetchone()
+        if row is None:
+            return None
+        entry = (json.loads(zlib.decompress(row[0])), row[1])
+        self._remember(source, key, entry)
+        return entry
+
+    def _remember(self, source, key, entry):
+        if len(self._mem) >= METADATA_MEMORY_ENTRIES:
+            self._mem.pop(next(iter(self._mem)), None)
+        self._mem[(source, key)] = entry
+
+    def _save(self, source, key, value):
+        fetched = time.time()
+        blob = zlib.compress(json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8"), 6)
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO metadata VALUES (?,?,?,?)", (source, key, blob, fetched))
+            self.conn.commit()
+        self._remember(source, key, (value, fetched))
+
+    def peek(self, source, key):
+        entry = self._load(source, key)
+        return None if entry is None else entry[0]
+
+    def is_fresh(self, source, key) -> bool:
+        entry = self._load(source, key)
+        return entry is not None and time.time() - entry[1] < fresh_for(source, entry[0])
+
+    def get(self, source, key, fetch):
+        entry = self._load(source, key)
+        if entry is not None:
+            value, fetched = entry
+            age = time.time() - fetched
+            if age < fresh_for(source, value):
+                self.counts[source, "신선"] += 1
+                return value
+            if age < METADATA_MAX_AGE:
+                self.counts[source, "오래됨"] += 1
+                self.revalidate(source, key, fetch)
+                return value
+        self.counts[source, "없음"] += 1
+        try:
+            return self.refresh(source, key, fetch)
+        except Exception:
+            if entry is None:
+                raise
+            return entry[0]
+
+    def refresh(self, source, key, fetch):
+        value = fetch(key)
+        if not value:
+            old = self._load(source, key)
+            if old is not None and old[0]:      # 있던 값을 빈 응답으로 덮지 않음 — 오래된 채로 두고 다음에 다시
+                raise ValueError(f"{source} {key}: 빈 응답, 이전 값 유지")
+        self._save(source, key, value)
+        return value
+
+    def revalidate(self, source, key, fetch):
+        """뒤에서 한 번만 새로 고침(같은 항목이 이미 진행 중이면 건너뜀)"""
+        with self.lock:
+            if (source, key) in self._inflight:
+                return
+            self._inflight.add((source, key))
+
+        def run():
+            try:
+                self.refresh(source, key, fetch)
+                self.counts[source, "갱신"] += 1
+            except Exception:
+                self.counts[source, "갱신 실패"] += 1
+            finally:
+                with self.lock:
+                    self._inflight.discard((source, key))
+
+        submit_task(run)
+
+    def stats(self) -> list:
+        with self.lock:
+            stored = dict(self.conn.execute("SELECT source, COUNT(*) FROM metadata GROUP BY source").fetchall())
+        return [{"출처": source, "저장": stored.get(source, 0),
+                 **{k: self.counts[source, k] for k in ("신선", "오래됨", "없음", "갱신", "갱신 실패")}}
+                for source in METADATA_POLICIES]
+
+@st.cache_resource
+def metadata_cache():
+    return MetadataCache(_cache_db())
+
+def warm_metadata(isbns, on_progress=None) -> Counter:
+    """입고 전 예열: 신선하지 않은 알라딘·국중 응답을 미리 받아 둡니다."""
+    cache = metadata_cache()
+    sources = (("aladin", _aladin_item_fetch), ("nlk", _nlk_doc_fetch))
+    isbns = list(dict.fromkeys(str(i).strip() for i in isbns if str(i).strip()))
+    futures = [
+        (source, submit_task(cache.refresh, source, isbn, fetch))
+        for isbn in isbns
+        for source, fetch in sources
+        if not cache.is_fresh(source, isbn)
+    ]
+    result = Counter()
+    for n, (source, future) in enumerate(futures, 1):
+        try:
+            future.result()
+            result["새로 받음"] += 1
+        except Exception:
+            result["실패"] += 1
+        if on_progress:
+            on_progress(n, len(futures))
+    result["이미 신선"] = len(isbns) * len(sources) - len(futures)
+    return result
+
+# 🗂️ 로컬 전거 색인 — 저자명·총서명 변이형을 정규화 키로 묶어 처음 본 표목 하나로 통일
+#    ('Ian Goodfellow' = 'Goodfellow, Ian', '토지 시리즈' = '토지시리즈'). 배치마다 조금씩 자랍니다.
+_AUTHORITY_DROP_RE = re.compile(r"\(.*?\)|\[.*?\]")
+
+@functools.lru_cache(maxsize=65536)
+def authority_key(kind: str, text: str) -> str:
+    tokens = _norm(_AUTHORITY_DROP_RE.sub(" ", text or "")).split()
+    return " ".join(sorted(tokens)) if kind == "name" else "".join(tokens)
+
+class AuthorityIndex:
+    """_cache_db() 안의 authority 테이블 + 전체를 올려 둔 dict (조회는 메모리에서 O(1))"""
+
+    def __init__(self, db):
+        self.conn, self.lock = db["conn"], db["lock"]
+        self._pid = os.getpid()
+        with self.lock:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS authority ("
+                " kind TEXT, key TEXT, heading TEXT, first_seen REAL, PRIMARY KEY (kind, key))"
+            )
+            self.conn.commit()
+            self._map = {(kind, key): heading for kind, key, heading
+                         in self.conn.execute("SELECT kind, key, heading FROM authority")}
+        self.hits = self.added = 0
+
+    def heading(self, kind: str, text: str) -> str:
+        """text의 전거 표목. 처음 보는 변이형이면 text 자체를 표목으로 등록합니다."""
+        key = authority_key(kind, text)
+        if not key:
+            return text
+        found = self._map.get((kind, key))
+        if found is not None:
+            self.hits += 1
+            return found
+        if os.getpid() != self._pid:     # fork된 CPU 단계(부모가 register_authority로 미리 채움): 연결은 건드리지 않음
+            self._map[kind, key] = text
+            return text
+        with self.lock:
+            found = self._map.setdefault((kind, key), text)
+            if found is text:
+                self.added += 1
+                self.conn.execute("INSERT OR IGNORE INTO authority VALUES (?,?,?,?)", (kind, key, text, time.time()))
+                self.conn.commit()
+        return found
+
+    def rows(self, kind=None, limit=500) -> list:
+        with self.lock:
+            return self.conn.execute(
+                "SELECT kind, key, heading FROM authority WHERE ? IS NULL OR kind=? ORDER BY first_seen DESC LIMIT ?",
+                (kind, kind, limit),
+            ).fetchall()
+
+    def stats(self) -> dict:
+        kinds = Counter(kind for kind, _ in self._map)
+        return {"저자명": kinds["name"], "총서명": kinds["series"], "적중": self.hits, "신규": self.added}
+
+@st.cache_resource
+def authority_index():
+    return AuthorityIndex(_cache_db())
+
+# 판차/장정/권차 표시는 같은 저작의 다른 ISBN끼리 달라지는 부분이라 지문에서 뺍니다
+_EDITION_RE = re.compile(r"\(.*?\)|\[.*?\]|개정\S*판|증보판|특별판|한정판|양장\S*|반양장|보급판|제?\s*\d+\s*[권부편]?\s*$")
+
+def content_fingerprint(title: str, description: str, toc: str):
+    """제목+소개+목차 → 64비트 SimHash (글자 3-gram, 제목은 가중치 2). 본문이 짧으면 None"""
+    t = _norm(_EDITION_RE.sub(" ", title or "")).replace(" ", "")
+    body = _norm(_KW_TAG_RE.sub(" ", html.unescape(f"{description or ''} {toc or ''}"))).replace(" ", "")
+    if len(t) + len(body) < SIMHASH_MIN_TEXT:
+        return None
+    weights = Counter()
+    for text, w in ((t, 2), (body, 1)):
+        for i in range(max(len(text) - 2, 1)):
+            weights[text[i:i + 3]] += w
+    acc = [0] * SIMHASH_BITS
+    for gram, w in weights.items():
+        h = int.from_bytes(hashlib.blake2b(gram.encode("utf-8"), digest_size=8).digest(), "big")
+        for bit in range(SIMHASH_BITS):
+            acc[bit] += w if (h >> bit) & 1 else -w
+    return sum(1 << bit for bit in range(SIMHASH_BITS) if acc[bit] > 0)
+
+def _simhash_bands(fp: int) -> list:
+    width = SIMHASH_BITS // SIMHASH_BANDS
+    return [(fp >> (i * width)) & ((1 << width) - 1) for i in range(SIMHASH_BANDS)]
+
+def _to_sqlite_int(fp: int) -> int:
+    return fp - (1 << 64) if fp >= (1 << 63) else fp
+
+class EnrichmentCache:
+    """SimHash 지문 → (KDC, 653). 밴드 색인으로 후보만 꺼내 해밍거리로 확인합니다."""
+
+    def __init__(self, db):
+        self.conn, self.lock = db["conn"], db["lock"]
+        with self.lock:
+            cols = [r[1] for r in self.conn.execute("PRAGMA table_info(enrichment)")]
+            legacy = []
+            if cols and cols != self._columns():
+                # 밴드 폭이 바뀌면 저장된 지문(fp)으로 밴드를 다시 계산해 옮깁니다
+                legacy = self.conn.execute("SELECT fp, isbn, kdc, kw653, created FROM enrichment").fetchall()
+                self.conn.execute("DROP TABLE enrichment")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS enrichment ("
+                " fp INTEGER, " + ", ".join(f"b{i} INTEGER" for i in range(SIMHASH_BANDS)) + ","
+                " isbn TEXT, kdc TEXT, kw653 TEXT, created REAL)"
+            )
+            self.conn.executemany(
+                self._insert_sql(),
+                [[fp, *_simhash_bands(fp & ((1 << 64) - 1)), isbn, kdc, kw653, created]
+                 for fp, isbn, kdc, kw653, created in legacy],
+            )
+            for i in range(SIMHASH_BANDS):
+                self.conn.execute(f"CREATE INDEX IF NOT EXISTS enrichment_b{i} ON enrichment(b{i})")
+            self.conn.commit()
+
+    @staticmethod
+    def _columns():
+        return ["fp", *(f"b{i}" for i in range(SIMHASH_BANDS)), "isbn", "kdc", "kw653", "created"]
+
+    def _insert_sql(self):
+        cols = self._columns()
+        return f"INSERT INTO enrichment ({', '.join(cols)}) VALUES ({','.join('?' * len(cols))})"
+
+    def lookup(self, fp):
+        if fp is None:
+            return None
+        bands = _simhash_bands(fp)
+        where = " OR ".join(f"b{i}=?" for i in range(SIMHASH_BANDS))
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT fp, isbn, kdc, kw653 FROM enrichment WHERE {where} ORDER BY created DESC LIMIT ?",
+                [*bands, SIMHASH_CANDIDATE_LIMIT],
+            ).fetchall()
+        best = None
+        for row_fp, isbn, kdc, kw653 in rows:
+            dist = bin((row_fp & ((1 << 64) - 1)) ^ fp).count("1")
+            if dist <= SIMHASH_MAX_DISTANCE and (best is None or dist < best["distance"]):
+                best = {"isbn": isbn, "kdc": kdc or "", "kw653": kw653 or "", "distance": dist}
+        return best
+
+    def store(self, fp, isbn, kdc="", kw653=""):
+        if fp is None or not (kdc or kw653):
+            return
+        with self.lock:
+            self.conn.execute(
+                self._insert_sql(),
+                [_to_sqlite_int(fp), *_simhash_bands(fp), isbn, kdc, kw653, time.time()],
+            )
+            self.conn.commit()
+
+@st.cache_resource
+def _enrichment_cache():
+    return EnrichmentCache(_cache_db())
+
+def _reuse_653(kw653: str, title: str, authors: str):
+    """다른 판본의 653을 이 레코드의 서명/저자 제외어로 다시 거른 뒤 재사용"""
+    kws = [m.group(1).strip() for m in _653_RE.finditer(kw653 or "")]
+    kept = filter_keywords(kws, _build_forbidden_index(title, authors))
+    return "".join(f"$a{kw}" for kw in kept) or None
+
+
+# ⚙️ 공유 작업 풀 — 레코드마다 풀을 만들지 않고 프로세스 전체가 나눠 씁니다
+#    http: 알라딘/국중/크롤링 (I/O 대기 위주라 넉넉히), llm: OpenAI 호출 (요금·속도 제한 때문에 좁게)
+#    hedge: 헤지 요청의 실제 HTTP 시도 (http 풀 작업이 다시 http 풀을 기다리며 막히지 않도록 따로).
+#           1차 시도가 http 작업자 수만큼 동시에 떠 있을 수 있으므로 그만큼 + 중복 요청용 여분(ISBN2MARC_HEDGE_WORKERS)
+_HTTP_WORKERS = int(os.environ.get("ISBN2MARC_HTTP_WORKERS", "16"))
+POOL_SIZES = {
+    "http": _HTTP_WORKERS,
+    "llm":  int(os.environ.get("ISBN2MARC_LLM_WORKERS", "4")),
+    "hedge": _HTTP_WORKERS + int(os.environ.get("ISBN2MARC_HEDGE_WORKERS", "8")),
+}
+
+class WorkerPool:
+    """이름 붙은 스레드 풀 + 대기열 깊이·가동률 지표"""
+
+    def __init__(self, name, max_workers):
+        self.name = name
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"isbn2marc-{name}")
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        self.submitted = self.completed = self.failed = self.active = 0
+        self.busy_seconds = 0.0
+
+    def submit(self, fn, *args, **kwargs):
+        with self._lock:
+            self.submitted += 1
+
+        def run():
+            t0 = time.monotonic()
+            with self._lock:
+                self.active += 1
+            ok = False
+            try:
+                result = fn(*args, **kwargs)
+                ok = True
+                return result
+            finally:
+                with self._lock:
+                    self.active -= 1
+                    self.completed += 1
+                    self.failed += not ok
+                    self.busy_seconds += time.monotonic() - t0
+
+        return self._executor.submit(run)
+
+    def idle(self) -> int:
+        """지금 바로 작업을 시작할 수 있는 작업자 수(대기열이 있으면 0)"""
+        with self._lock:
+            return max(0, self.max_workers - (self.submitted - self.completed))
+
+    def stats(self) -> dict:
+        with self._lock:
+            elapsed = max(time.monotonic() - self._started, 1e-9)
+            return {
+                "풀": self.name,
+                "작업자": self.max_workers,
+                "실행 중": self.active,
+                "대기열": self.submitted - self.completed - self.active,
+                "완료": self.completed,
+                "실패": self.failed,
+                "현재 가동률": round(self.active / self.max_workers, 2),
+                "누적 가동률": round(self.busy_seconds / (elapsed * self.max_workers), 3),
+            }
+
+@st.cache_resource
+def _worker_pools():
+    return {name: WorkerPool(name, size) for name, size in POOL_SIZES.items()}
+
+def submit_task(fn, *args, pool="http", **kwargs):
+    """공유 풀에 제출. 작업 스레드에서도 st.* 호출이 현재 세션 화면에 그려지도록 컨텍스트를 넘깁니다."""
+    ctx = get_script_run_ctx(suppress_warning=True)
+
+    def run():
+        # 풀 스레드는 오래 살므로 작업이 끝나면 컨텍스트를 되돌려 둡니다
+        # (안 그러면 컨텍스트 없이 제출된 뒤 작업의 st.* 출력이 앞 세션 화면으로 감)
+        thread = threading.current_thread()
+        previous = getattr(thread, SCRIPT_RUN_CONTEXT_ATTR_NAME, None)
+        if ctx is not None:
+            add_script_run_ctx(thread, ctx)
+        else:
+            setattr(thread, SCRIPT_RUN_CONTEXT_ATTR_NAME, None)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            setattr(thread, SCRIPT_RUN_CONTEXT_ATTR_NAME, previous)
+
+    return _worker_pools()[pool].submit(run)
+
+def pool_stats() -> list:
+    return [p.stats() for p in _worker_pools().values()]
+
+
+# 🪃 헤지 요청 — 첫 호출이 호스트별 p95 안에 안 오면 같은 요청을 한 번 더 보내고 먼저 온 응답을 씁니다
+#    헤지는 일반 호출마다 HEDGE_BUDGET_RATIO씩 쌓이는 토큰을 써야 나가므로 추가 부하가 그 비율로 묶입니다.
+HEDGE_ENABLED = os.environ.get("ISBN2MARC_HEDGE", "1") != "0"
+HEDGE_QUANTILE = 0.95
+HEDGE_MIN_SAMPLES = 20          # 이보다 적게 관측된 호스트는 헤지하지 않음
+HEDGE_MIN_DELAY = 0.05          # 초
+HEDGE_BUDGET_RATIO = 0.05       # 일반 호출 대비 헤지 비율 상한
+HEDGE_BUDGET_BURST = 10.0
+
+class LatencyHistogram:
+    """로그 간격 버킷(1ms~60s, 10%씩) — 메모리 고정, 분위수는 버킷 상한으로 근사.
+    DECAY_EVERY개를 넘으면 전체를 반으로 줄여 최근 지연 쪽으로 따라갑니다."""
+    BASE, GROWTH, BUCKETS = 0.001, 1.1, 116
+    DECAY_EVERY = 2000
+
+    def __init__(self):
+        self.counts = [0] * (self.BUCKETS + 1)
+        self.total = 0
+
+    def observe(self, sec):
+        i = 0 if sec <= self.BASE else int(math.log(sec / self.BASE, self.GROWTH)) + 1
+        self.counts[min(i, self.BUCKETS)] += 1
+        self.total += 1
+        if self.total >= self.DECAY_EVERY:
+            self.counts = [c // 2 for c in self.counts]
+            self.total = sum(self.counts)
+
+    def quantile(self, q):
+        if not self.total:
+            return 0.0
+        rank, seen = q * self.total, 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= rank:
+                return self.BASE * self.GROWTH ** i
+        return self.BASE * self.GROWTH ** self.BUCKETS
+
+class HedgeController:
+    """호스트별 지연 히스토그램 + 헤지 예산(토큰 버킷)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hosts = {}
+        self.tokens = 0.0
+        self.primaries = Counter()
+        self.hedges = Counter()
+        self.hedge_wins = Counter()
+        self.denied = Counter()
+
+    def observe(self, host, sec):
+        with self._lock:
+            self.hosts.setdefault(host, LatencyHistogram()).observe(sec)
+
+    def threshold(self, host):
+        """헤지 기준 지연(초). 표본이 모자라면 None"""
+        with self._lock:
+            h = self.hosts.get(host)
+            if h is None or h.total < HEDGE_MIN_SAMPLES:
+                return None
+            return max(HEDGE_MIN_DELAY, h.quantile(HEDGE_QUANTILE))
+
+    def primary(self, host):
+        with self._lock:
+            self.primaries[host] += 1
+            self.tokens = min(HEDGE_BUDGET_BURST, self.tokens + HEDGE_BUDGET_RATIO)
+
+    def can_hedge(self) -> bool:
+        with self._lock:
+            return self.tokens >= 1.0
+
+    def try_hedge(self, host) -> bool:
+        with self._lock:
+            if self.tokens < 1.0:
+                self.denied[host] += 1
+                return False
+            self.tokens -= 1.0
+            self.hedges[host] += 1
+            return True
+
+    def won(self, host):
+        with self._lock:
+            self.hedge_wins[host] += 1
+
+    def rows(self) -> list:
+        with self._lock:
+            return [{
+                "호스트": host,
+                "표본": h.total,
+                "p50(ms)": round(h.quantile(0.5) * 1000),
+                "p95(ms)": round(h.quantile(0.95) * 1000),
+                "p99(ms)": round(h.quantile(0.99) * 1000),
+                "호출": self.primaries[host],
+                "헤지": self.hedges[host],
+                "헤지 승": self.hedge_wins[host],
+                "예산 부족": self.denied[host],
+            } for host, h in self.hosts.items()]
+
+@st.cache_resource
+def hedge_controller():
+    return HedgeController()
+
+def hedged_get(host, fn, *args, **kwargs):
+    """fn(*args, **kwargs)(HTTP GET)을 호스트 기준으로 헤지해서 실행. 둘 다 실패하면 첫 예외를 올립니다."""
+    ctl = hedge_controller()
+    ctl.primary(host)
+
+    def attempt():
+        t0 = time.monotonic()
+        resp = fn(*args, **kwargs)
+        ctl.observe(host, time.monotonic() - t0)
+        return resp
+
+    delay = ctl.threshold(host) if HEDGE_ENABLED else None
+    pool = _worker_pools()["hedge"]
+    if delay is None or not ctl.can_hedge() or not pool.idle():
+        return attempt()        # 헤지를 낼 수 없거나 빈 작업자가 없으면 줄 서지 않고 호출 스레드에서 바로
+
+    started = []                # 헤지 타이머는 제출이 아니라 시도가 실제로 시작된 때부터
+    started_event = threading.Event()
+
+    def first_attempt():
+        started.append(time.monotonic())
+        started_event.set()
+        return attempt()
+
+    first = pool.submit(first_attempt)
+    started_event.wait()        # 빈 작업자가 있을 때만 제출하므로 곧바로 시작됨
+    try:
+        return first.result(timeout=max(0.0, started[0] + delay - time.monotonic()))
+    except FuturesTimeout:
+        pass
+    if not ctl.try_hedge(host):
+        return first.result()
+
+    second = pool.submit(attempt)
+    pending = {first, second}
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for f in done:
+            try:
+                resp = f.result()
+            except Exception as e:
+                error = error or e
+                continue
+            if f is second:
+                ctl.won(host)
+            for loser in pending | (done - {f}):     # 늦게 온 쪽은 연결만 돌려줌
+                loser.add_done_callback(lambda f: f.exception() is None and f.result().close())
+            return resp
+    raise error
+
+
+# ⏱️ 레코드당 지연 예산 — 예산 안에 못 온 필드(020 $g / 056 / 653)는 비워 두고 보강 대기열로
+RECORD_BUDGET_SEC = float(os.environ.get("ISBN2MARC_RECORD_BUDGET", "12"))
+
+def _remaining(deadline):
+    return None if deadline is None else max(0.0, deadline - time.monotonic())
+
+LATE_RESULTS_MAX = 5000        # 보강되지 못하고 남는 항목이 쌓이지 않도록 오래된 것부터 버림
+
+@st.cache_resource
+def _late_results():
+    """예산을 넘겨 버려진 작업이 뒤늦게 끝난 결과 {(isbn, 필드): 값} — 보강 작업자가 먼저 씁니다."""
+    return {}
+
+def _result_by(future, deadline, isbn, field, park=True):
+    """deadline까지 결과를 기다리고, 넘기면 None. park면 늦게 끝난 결과를 _late_results()에 남깁니다
+    (보강 대기열이 다루는 020$g/056/653만)."""
+    try:
+        return future.result(timeout=_remaining(deadline))
+    except FuturesTimeout:
+        def keep(f, key=(str(isbn).strip(), field)):
+            if not f.cancelled() and f.exception() is None and f.result():
+                late = _late_results()
+                while len(late) >= LATE_RESULTS_MAX:
+                    late.pop(next(iter(late)), None)
+                late[key] = f.result()
+        if park:
+            future.add_done_callback(keep)
+        return None
+
 
-    # 1) 알라딘 + (옵션) 국중 부가기호 동시 요청
-    url = (
-        f"https://www.aladin.co.kr/ttb/api/ItemLookUp.aspx?"
-        f"ttbkey={aladin_key}&itemIdType=ISBN&ItemId={isbn}"
-        f"&output=js&Version=20131101"
-    )
-    with ThreadPoolExecutor(max_workers=2) as ex:
-        future_aladin = ex.submit(lambda: requests.get(url, verify=False, timeout=5))
-        future_nlk    = ex.submit(fetch_additional_code_from_nlk, isbn)
+# 🔧 KDC/653 보강 — 근사 중복 캐시 → (총서 대표권 결과) → GPT → 로컬 추출 순
+def enrich_kdc_653(isbn, title, author, category, description, toc,
+                   offline_653=False, series_kdc="", series_653="", on_partial=None, deadline=None,
+                   known=None, series_rep=False):
+    # known: 이 ISBN의 지난 스냅샷에서 이미 확정된 값 {"kdc", "kw653"} (보강 대기열이 채운 값 포함)
+    # series_rep: 이 권이 다권본 대표권 — series_kdc/653이 묶음 단계에서 이 권으로 보강한 값 그대로
+    authors = _clean_author_str(author)
+    known = known or {}
+    if known.get("kdc") and known.get("kw653"):
+        return known["kdc"], known["kw653"], []
+
+    # 소개+목차는 로컬 말뭉치(DF)에도 쌓아 둡니다
+    kw_tokens = add_to_keyword_corpus(f"{description} {toc}")
+
+    # 다권본 대표권: 묶음 단계 결과가 곧 이 권의 값(다시 보충하지 않음)
+    if series_rep:
+        return known.get("kdc") or series_kdc, known.get("kw653") or series_653 or None, []
+
+    # 다권본 형제 권: 대표권의 KDC·653을 물려받고, 이 권 고유 키워드로만 보충
+    if series_kdc or series_653:
+        kdc = known.get("kdc") or series_kdc
+        if not kdc:                     # 대표권 KDC가 없으면 이 권만 — llm 풀에서 레코드 예산 안에
+            kdc = _result_by(submit_task(recommend_kdc, title, author, api_key=openai_key, pool="llm"),
+                             deadline, isbn, "056") or "000"
+        kw653 = known.get("kw653")
+        if not kw653:
+            kws = [m.group(1).strip() for m in _653_RE.finditer(series_653 or "")]
+            local = generate_653_local(category, title, authors, description, toc,
+                                       max_keywords=7, tokens=kw_tokens) or ""
+            kws += [m.group(1).strip() for m in _653_RE.finditer(local)]
+            kept = filter_keywords(kws, _build_forbidden_index(title, authors))[:7]
+            kw653 = "".join(f"$a{kw}" for kw in kept) or None
+        return kdc, kw653, ["056"] if kdc in ("", "000") else []
+
+    #    근사 중복(다른 판본/권차) 캐시에 있으면 GPT 호출 없이 재사용
+    fingerprint = content_fingerprint(title, description, toc)
+    reused = _enrichment_cache().lookup(fingerprint)
+    if fingerprint is not None:
+        pipeline_stats().cache("보강(근사중복)", reused)
+
+    # KDC와 653은 서로 독립 → llm 풀에서 동시에
+    kdc = known.get("kdc") or (reused["kdc"] if reused else "")
+    kdc_future = None if kdc else submit_task(recommend_kdc, title, author, api_key=openai_key, pool="llm")
+
+    # ⬇️ authors 인자 추가(저자 문자열을 전처리해서 넘김)
+    gpt_653 = known.get("kw653") or (_reuse_653(reused["kw653"], title, authors) if reused else None)
+    if not gpt_653 and not offline_653:
+        gpt_653 = _result_by(submit_task(
+            generate_653_with_gpt, category, title, authors, description, toc,
+            max_keywords=7, on_partial=on_partial, pool="llm",
+        ), deadline, isbn, "653")
+    if kdc_future is not None:
+        kdc = _result_by(kdc_future, deadline, isbn, "056") or "000"
+    if not reused:
+        _enrichment_cache().store(fingerprint, isbn, kdc if kdc != "000" else "", gpt_653 or "")
+
+    # GPT가 실패/차단돼 빠진 필드는 나중에 보강할 수 있도록 표시
+    missing = []
+    if kdc in ("", "000"):
+        missing.append("056")
+    if not gpt_653 and not offline_653:
+        missing.append("653")
+    if not gpt_653:
+        # GPT 실패/오프라인 → 로컬 TF-IDF 추출로 대체
+        gpt_653 = generate_653_local(
+            category, title, authors, description, toc,
+            max_keywords=7, tokens=kw_tokens,
+        )
+    return kdc, gpt_653, missing
+
+
+# 📚📚 다권본(총서) 묶음 처리 — 같은 총서·저자는 대표권 하나만 KDC/653 보강
+def _safe_aladin_metadata(isbn):
+    try:
+        return fetch_aladin_metadata(isbn)
+    except Exception:
+        return None
+
+def _series_key(meta):
+    if not authority_key("series", meta["series_name"]):
+        return None
+    index = authority_index()
+    contributors = parse_contributors(meta["author"])
+    first_author = index.heading("name", contributors[0].heading) if contributors else ""
+    return index.heading("series", meta["series_name"].strip()), first_author
+
+def plan_series_batch(rows, offline_653=False, pace=None, budget=None, on_progress=None):
+    """CSV 행 목록 → 행별 fetch_book_data_from_aladin 추가 인자(dict) 목록.
+
+    알라딘 ItemLookUp만 먼저 모두 받아 seriesName(+첫 저자)으로 묶고,
+    두 권 이상인 묶음은 대표권(첫 행)만 보강해 490/830·KDC·653을 형제 권에 물려줍니다.
+    권차($v)·020·가격·008 날짜는 각 권 ISBN의 응답을 그대로 씁니다.
+    대표권끼리는 서로 독립이라 동시에 보강하고(GPT 호출은 llm 풀), 각각 레코드 예산(budget초) 안에서 끝냅니다.
+    pace(미리 받기용)가 있으면 상류를 부를 때마다 먼저 호출하고, False를 돌려주면 거기서 멈춥니다(이때는 하나씩).
+    """
+    isbns = [str(r[0]).strip() for r in rows]
+    plan = [{} for _ in rows]
+    if pace is None:
+        metas = [f.result() for f in [submit_task(_safe_aladin_metadata, i) for i in isbns]]
+    else:
+        metas = []
+        for isbn in isbns:
+            if not metadata_cache().is_fresh("aladin", isbn) and not pace():
+                return plan
+            metas.append(_safe_aladin_metadata(isbn))
+
+    groups = {}
+    for i, meta in enumerate(metas):
+        key = _series_key(meta) if meta else None
+        if key:
+            groups.setdefault(key, []).append(i)
+
+    def enrich_rep(i, known, deadline=None):
+        rep = metas[i]
+        return enrich_kdc_653(
+            isbns[i], rep["title"], rep["author"], rep["category"],
+            rep["description"], rep["toc"], offline_653=offline_653, known=known, deadline=deadline,
+        )
 
+    series = [idxs for idxs in groups.values() if len(idxs) >= 2]
+    if pace is None:
+        deadline = time.monotonic() + budget if budget else None
+        futures = [submit_task(enrich_rep, idxs[0], settled_llm(_snapshot_store().get(isbns[idxs[0]])), deadline)
+                   for idxs in series]
+    for n, idxs in enumerate(series, 1):
         try:
-            resp = future_aladin.result()
-            resp.raise_for_status()
-            data = resp.json().get("item", [{}])[0]
-        except Exception as e:
-            st.error(f"🚨 알라딘API 오류: {e}")
-            return ""
+            if pace is None:
+                kdc, kw653, missing = futures[n - 1].result()
+            else:
+                known = settled_llm(_snapshot_store().get(isbns[idxs[0]]))
+                if not (known.get("kdc") and known.get("kw653")) and not pace():
+                    return plan
+                kdc, kw653, missing = enrich_rep(idxs[0], known)
+        except Exception:
+            kdc = None
+        if on_progress:
+            on_progress(n, len(series))
+        if kdc is None:
+            continue
+        shared = {
+            "series_kdc":  kdc if kdc and kdc != "000" else "",
+            "series_653":  kw653 or "",
+            "series_name": metas[idxs[0]]["series_name"],
+        }
+        for i in idxs[1:]:
+            plan[i] = shared
+        # 대표권은 묶음 단계 결과를 그대로(빠진 필드가 있으면 자기 차례에 다시 보강)
+        plan[idxs[0]] = {**shared, "series_rep": True} if not missing else {"series_name": shared["series_name"]}
+    return plan
+
+def plan_series_with_progress(rows, offline_653=False, budget=None) -> list:
+    """화면용 plan_series_batch: 대표권 보강 진행을 출력 전에 보여 줍니다."""
+    box = st.empty()
+    plan = plan_series_batch(rows, offline_653, budget=budget,
+                             on_progress=lambda n, total: box.caption(f"📚 다권본 대표권 보강 {n}/{total}"))
+    box.empty()
+    return plan
+
+
+# 📚 MARC 조립 — 이미 받아 둔 메타데이터만으로 필드를 만듭니다(네트워크 없음)
+# 🏷️ 020 엔진 — ISBN·정가·부가기호를 배치 전체에 대해 한 번에(pandas/numpy 열 연산) 정리
+#    국중 응답의 필드명 변이(EA_ADD_CODE / 예전 ADDCODE)와 세트 ISBN을 한 곳에서 흡수하고,
+#    알라딘과 어긋나면: 국중 문서가 다른 ISBN이면 그 값은 버림, 정가는 알라딘 > 국중 PRE_PRICE > 상품 페이지.
+NLK_020_FIELDS = ("EA_ISBN", "EA_ADD_CODE", "ADDCODE", "SET_ISBN", "SET_ADD_CODE", "PRE_PRICE")
+ADD_CODE_PATTERN = r"[0-24-79][0-46-8]\d{3}"   # 독자대상(3·8 예비 제외) + 발행형태(5·9 예비 제외) + 내용분류 3자리
+_020_CONFLICTS = {
+    "isbn_invalid": "ISBN 검증 실패",
+    "nlk_mismatch": "국중 문서 ISBN 불일치",
+    "add_code_invalid": "부가기호 형식 오류",
+    "price_mismatch": "알라딘·국중 정가 불일치",
+}
 
-        add_code = future_nlk.result()  # 실패 시 빈 문자열
+def _digits(s: pd.Series, keep="0-9") -> pd.Series:
+    return s.fillna("").astype(str).str.upper().str.replace(f"[^{keep}]", "", regex=True)
+
+def _isbn_valid(isbn: pd.Series) -> pd.Series:
+    """ISBN-13/10 체크 숫자 검사 (길이별로 한 번에 numpy 행렬 연산)"""
+    valid = pd.Series(False, index=isbn.index)
+    for width, pattern, weights, mod in (
+        (13, r"97[89]\d{10}", np.tile([1, 3], 7)[:13], 10),
+        (10, r"\d{9}[\dX]", np.arange(10, 0, -1), 11),
+    ):
+        rows = isbn.str.fullmatch(pattern)
+        if rows.any():
+            codes = np.frombuffer("".join(isbn[rows]).encode("ascii"), dtype=np.uint8).reshape(-1, width)
+            digits = np.where(codes == ord("X"), 10, codes.astype(np.int64) - ord("0"))
+            valid[rows] = (digits * weights).sum(axis=1) % mod == 0
+    return valid
+
+def _isbn13(isbn: pd.Series) -> pd.Series:
+    """비교용: ISBN-10은 978 접두 + 체크 숫자 재계산으로 ISBN-13에 맞춥니다(나머지는 그대로)."""
+    rows = isbn.str.fullmatch(r"\d{9}[\dX]")
+    if not rows.any():
+        return isbn
+    body = "978" + isbn[rows].str[:9]
+    codes = np.frombuffer("".join(body).encode("ascii"), dtype=np.uint8).reshape(-1, 12).astype(np.int64) - ord("0")
+    check = (10 - (codes * np.tile([1, 3], 6)).sum(axis=1) % 10) % 10
+    out = isbn.copy()
+    out[rows] = body + pd.Series(check, index=body.index).astype(str)
+    return out
+
+def frame_020(jobs) -> pd.DataFrame:
+    """build_marc_record 인자(dict) 목록 → 020 엔진 입력 열"""
+    return pd.DataFrame([{
+        "isbn": str(job["isbn"]).strip(),
+        "aladin_price": job["meta"]["price"],
+        "page_price": (job.get("page") or {}).get("price", ""),
+        "add_code": job.get("add_code", ""),
+        **{field: (job.get("nlk") or {}).get(field, "") for field in NLK_020_FIELDS},
+    } for job in jobs], columns=["isbn", "aladin_price", "page_price", "add_code", *NLK_020_FIELDS])
+
+def resolve_020(frame: pd.DataFrame) -> pd.DataFrame:
+    """열 연산만으로 tag_020(세트 ISBN이 있으면 두 줄) / price(950용) / add_code / conflicts"""
+    isbn = _digits(frame["isbn"], "0-9X")
+    isbn = isbn.where(isbn != "", frame["isbn"].astype(str))
+    ea_isbn, set_isbn = _digits(frame["EA_ISBN"], "0-9X"), _digits(frame["SET_ISBN"], "0-9X")
+    isbn13 = _isbn13(isbn)                          # 국중은 ISBN-13으로 주므로 ISBN-10 입력도 13자리로 맞춰 비교
+    nlk_ok = (ea_isbn == "") | (_isbn13(ea_isbn) == isbn13)
+    is_set = (set_isbn != "") & (_isbn13(set_isbn) == isbn13)     # 입력 자체가 세트 ISBN
+
+    raw_add = _digits(frame["EA_ADD_CODE"])
+    raw_add = raw_add.where(raw_add != "", _digits(frame["ADDCODE"]))
+    raw_add = raw_add.where(raw_add != "", _digits(frame["add_code"]))
+    set_add = _digits(frame["SET_ADD_CODE"])
+    raw_add = raw_add.where(~is_set | (set_add == ""), set_add).where(nlk_ok, "")
+    add_ok = raw_add.str.fullmatch(ADD_CODE_PATTERN)
+    add_code = raw_add.where(add_ok, "")
+    set_add = set_add.where(set_add.str.fullmatch(ADD_CODE_PATTERN), "")
+
+    aladin_price = _digits(frame["aladin_price"]).str.lstrip("0")
+    nlk_price = _digits(frame["PRE_PRICE"]).str.lstrip("0").where(nlk_ok, "")
+    page_price = _digits(frame["page_price"]).str.lstrip("0")
+    price = aladin_price.where(aladin_price != "", nlk_price)
+    price = price.where(price != "", page_price)
+
+    show_set = (set_isbn != "") & ~is_set & nlk_ok
+    tag_020 = ("=020  \\$a" + isbn
+               + (":$c" + price).where(price != "", "")
+               + ("$g" + add_code).where(add_code != "", "")
+               + ("\n=020  1\\$a" + set_isbn + "(세트)"
+                  + ("$g" + set_add).where(set_add != "", "")).where(show_set, ""))
+
+    flags = pd.DataFrame({
+        "isbn_invalid": ~_isbn_valid(isbn),
+        "nlk_mismatch": ~nlk_ok,
+        "add_code_invalid": (raw_add != "") & ~add_ok,
+        "price_mismatch": (aladin_price != "") & (nlk_price != "") & (aladin_price != nlk_price),
+    })
+    labels = pd.Series([f"{_020_CONFLICTS[c]};" for c in flags.columns], index=flags.columns)
+    conflicts = flags.astype(object).dot(labels).str.rstrip(";")
+    return pd.DataFrame({"tag_020": tag_020, "price": price, "add_code": add_code, "conflicts": conflicts})
+
+def _digits_one(value, keep="0-9") -> str:
+    return re.sub(f"[^{keep}]", "", str(value if value is not None else "").upper())
+
+def _isbn13_one(isbn: str) -> str:
+    if not re.fullmatch(r"\d{9}[\dX]", isbn):
+        return isbn
+    body = "978" + isbn[:9]
+    return body + str((10 - sum(int(d) * (3 if i % 2 else 1) for i, d in enumerate(body)) % 10) % 10)
+
+def _isbn_valid_one(isbn: str) -> bool:
+    if re.fullmatch(r"97[89]\d{10}", isbn):
+        return sum(int(d) * (3 if i % 2 else 1) for i, d in enumerate(isbn)) % 10 == 0
+    if re.fullmatch(r"\d{9}[\dX]", isbn):
+        return sum((10 if d == "X" else int(d)) * (10 - i) for i, d in enumerate(isbn)) % 11 == 0
+    return False
+
+def _resolve_020_one(job) -> dict:
+    """한 건짜리 호출(단건·인라인 변환)용 — resolve_020과 같은 규칙을 문자열 연산으로 (DataFrame 생성 비용 없음).
+    규칙을 고치면 resolve_020도 같이 고치고 점검_020.py로 두 결과가 같은지 확인하세요."""
+    nlk = job.get("nlk") or {}
+    raw_isbn = str(job["isbn"]).strip()
+    isbn = _digits_one(raw_isbn, "0-9X") or raw_isbn
+    ea_isbn, set_isbn = _digits_one(nlk.get("EA_ISBN"), "0-9X"), _digits_one(nlk.get("SET_ISBN"), "0-9X")
+    isbn13 = _isbn13_one(isbn)
+    nlk_ok = ea_isbn == "" or _isbn13_one(ea_isbn) == isbn13
+    is_set = set_isbn != "" and _isbn13_one(set_isbn) == isbn13
+
+    raw_add = (_digits_one(nlk.get("EA_ADD_CODE")) or _digits_one(nlk.get("ADDCODE"))
+               or _digits_one(job.get("add_code")))
+    set_add = _digits_one(nlk.get("SET_ADD_CODE"))
+    if is_set and set_add:
+        raw_add = set_add
+    if not nlk_ok:
+        raw_add = ""
+    add_ok = re.fullmatch(ADD_CODE_PATTERN, raw_add) is not None
+    add_code = raw_add if add_ok else ""
+    set_add = set_add if re.fullmatch(ADD_CODE_PATTERN, set_add) else ""
+
+    aladin_price = _digits_one(job["meta"]["price"]).lstrip("0")
+    nlk_price = _digits_one(nlk.get("PRE_PRICE")).lstrip("0") if nlk_ok else ""
+    page_price = _digits_one((job.get("page") or {}).get("price")).lstrip("0")
+    price = aladin_price or nlk_price or page_price
+
+    tag_020 = (f"=020  \\$a{isbn}" + (f":$c{price}" if price else "") + (f"$g{add_code}" if add_code else ""))
+    if set_isbn and not is_set and nlk_ok:
+        tag_020 += f"\n=020  1\\$a{set_isbn}(세트)" + (f"$g{set_add}" if set_add else "")
+
+    flags = {
+        "isbn_invalid": not _isbn_valid_one(isbn),
+        "nlk_mismatch": not nlk_ok,
+        "add_code_invalid": raw_add != "" and not add_ok,
+        "price_mismatch": aladin_price != "" and nlk_price != "" and aladin_price != nlk_price,
+    }
+    conflicts = ";".join(_020_CONFLICTS[c] for c, hit in flags.items() if hit)
+    return {"tag_020": tag_020, "price": price, "add_code": add_code, "conflicts": conflicts}
+
+def build_020_batch(jobs) -> list:
+    """배치 전체의 020을 한 번에 → 레코드별 {"tag_020", "price", "add_code", "conflicts"}"""
+    jobs = list(jobs)
+    if not jobs:
+        return []
+    if len(jobs) == 1:
+        return [_resolve_020_one(jobs[0])]
+    return resolve_020(frame_020(jobs)).to_dict("records")
+
+
+def build_marc_record(isbn, meta, add_code="", page=None, kdc="", kw653=None,
+                      reg_mark="", reg_no="", copy_symbol="", series_name="", missing=(),
+                      nlk=None, f020=None, date_entered=None, authority=None):
+    # missing: 차단·실패로 비어 있는 필드 목록(보강 대기). 해당 필드는 그냥 생략됩니다.
+    # date_entered: 008/00-05 (스냅샷에 남은 처음 입력일). 없으면 오늘.
+    # f020: 020 엔진 결과(배치 단계에서 미리 계산). 없으면 이 레코드 하나로 계산합니다.
+    # authority: 100/700/830 표목을 고를 전거 색인. 없으면 authority_index() (fork된 샤드는 부모 것을 넘겨받음)
+    page = page or {}
+    authority = authority or authority_index()
+    if f020 is None:
+        f020 = build_020_batch([{"isbn": isbn, "meta": meta, "page": page, "add_code": add_code, "nlk": nlk}])[0]
 
     # 2) 메타데이터 (알라딘)
-    title       = data.get("title",       "제목없음")
-    author      = data.get("author",      "저자미상")
-    publisher   = data.get("publisher",   "출판사미상")
-    pubdate     = data.get("pubDate",     "2025")  # 'YYYY' 또는 'YYYY-MM-DD'
-    category    = data.get("categoryName", "")
-    description = data.get("description", "")
-    toc         = data.get("subInfo", {}).get("toc", "")
-    price       = str(data.get("priceStandard", ""))  # 020/950 용
-
-    # 3) =008 생성 (ISBN만으로 자동, country/lang은 임시 고정값 → 추후 override)
+    title       = meta["title"]     or "제목없음"
+    contributors = parse_contributors(meta["author"])
+    publisher   = meta["publisher"] or "출판사미상"
+    pubdate     = meta["pubdate"]   or "2025"  # 'YYYY' 또는 'YYYY-MM-DD'
+    category    = meta["category"]
+    description = meta["description"]
+    price       = f020["price"]     # 020/950 용 (알라딘 > 국중 > 상품 페이지)
+
+    # 3) 언어: ISBN별로 한 번 감지해 041·546·008/35-37이 같이 씁니다 (원제가 없으면 상품 페이지에서 본 원저 언어)
+    lang_a, lang_h = detect_record_languages(isbn, title, meta["original_title"], description)
+    if not meta["original_title"] and page.get("original_lang", "und") not in ("und", lang_a):
+        lang_h = page["original_lang"]
+
+    # 4) =008/007 생성 (ISBN만으로 자동, country는 임시 고정값 → 추후 override)
+    material = detect_material_format(meta.get("mall_type", ""), category)
     tag_008 = "=008  " + build_008_from_isbn(
         isbn,
         aladin_pubdate=pubdate,
@@ -527,56 +2149,44 @@ def fetch_book_data_from_aladin(isbn, reg_mark="", reg_no="", copy_symbol=""):
         aladin_category=category,
         aladin_desc=description,
         # override_country3="ulk",  # 300 모듈 완성 시 사용
-        # override_lang3="kor",     # 041 모듈 완성 시 사용
+        override_lang3=lang_a if lang_a != "und" else None,
+        material=material,
+        date_entered=date_entered,
     )
 
-    # 4) 041/546 (간이 감지: 기존 로직 유지)
-    lang_a  = detect_language(title)
-    lang_h  = detect_language(data.get("title", ""))
-    tag_041 = f"=041  \\$a{lang_a}" + (f"$h{lang_h}" if lang_h != "und" else "")
+    # 041/546 (위에서 감지한 언어: $a 본문, $h 원저)
+    tag_041 = f"=041  \\$a{lang_a}" + (f"$h{lang_h}" if lang_h else "")
     tag_546 = f"=546  \\$a{generate_546_from_041_kormarc(tag_041)}"
 
-    # 5) 020 (부가기호 있으면 $g 추가)
-    tag_020 = f"=020  \\$a{isbn}"
-    if price:
-        tag_020 += f":$c{price}"
-    if add_code:
-        tag_020 += f"$g{add_code}"
+    # 5) 020 (020 엔진: 검증된 부가기호 $g, 세트 ISBN은 둘째 020)
+    tag_020 = f020["tag_020"]
 
+    # 6) 653/KDC — 보강 결과(enrich_kdc_653)
+    tag_653 = f"=653  \\{kw653.replace(' ', '')}" if kw653 else ""
 
-    # 6) 653/KDC — ✅ 여기서만 생성 (GPTAPI 최신 함수로 통일)
-    kdc     = recommend_kdc(title, author, api_key=openai_key)
-
-    # ⬇️ authors 인자 추가(저자 문자열을 전처리해서 넘김)
-    gpt_653 = generate_653_with_gpt(
-    category,
-    title,
-    _clean_author_str(author),   # ← 추가된 부분
-    description,
-    toc,
-    max_keywords=7
-    )
-
-    tag_653 = f"=653  \\{gpt_653.replace(' ', '')}" if gpt_653 else ""
-
+    # 245 $d/$e · 100 · 700 (기여자 한 번 파싱)
+    responsibility = build_245_responsibility(contributors)
+    tag_100, tags_700 = build_100_700(contributors, authority)
 
     # 7) 기본 MARC 라인
     marc_lines = [
         tag_008,
-        "=007  ta",
-        f"=245  00$a{title} /$c{author}",
+        f"=007  {build_007(material, category)}",
+        f"=245  {'1' if tag_100 else '0'}0$a{title}" + (f" /{responsibility}" if responsibility else ""),
         f"=260  \\$a서울 :$b{publisher},$c{pubdate[:4]}.",
     ]
 
     # 8) 490·830 (총서)
-    series = data.get("seriesInfo", {})
-    name = (series.get("seriesName") or "").strip()
-    vol  = (series.get("volume")    or "").strip()
+    name = (series_name or meta["series_name"]).strip()   # 다권본은 대표권 총서명으로 통일
+    vol  = meta["volume"]
     if name:
-        marc_lines.append(f"=490  \\$a{name};$v{vol}")
-        marc_lines.append(f"=830  \\$a{name};$v{vol}")
+        marc_lines.append(f"=490  \\$a{name};$v{vol}")     # 490은 자료에 적힌 대로, 830은 전거 표목
+        marc_lines.append(f"=830  \\$a{authority.heading('series', name)};$v{vol}")
 
     # 9) 기타 필드
+    if tag_100:
+        marc_lines.append(tag_100)
+    marc_lines.extend(tags_700)
     marc_lines.append(tag_020)
     marc_lines.append(tag_041)
     marc_lines.append(tag_546)
@@ -594,10 +2204,825 @@ def fetch_book_data_from_aladin(isbn, reg_mark="", reg_no="", copy_symbol=""):
         marc_lines.append(line)
 
     # 11) 번호 오름차순 정렬 후 출력
-    marc_lines.sort(key=lambda L: int(re.match(r"=(\d+)", L).group(1)))
+    marc_lines.sort(key=lambda L: int(_TAG_RE.match(L).group(1)))
     return "\n".join(marc_lines)
 
+_TAG_RE = re.compile(r"=(\d+)")
+
+
+# 📚 MARC 생성 — 레코드 하나를 작은 의존 그래프로 실행
+#    알라딘 item ─┬─ 008·041/546 (로컬 계산)
+#                ├─ KDC ┐ (enrich_kdc_653 안에서 동시)
+#                ├─ 653 ┘
+#                └─ 정가 크롤링(필요할 때만)
+#    국중 ───────── 020 $g
+#    → 지연시간은 단계 합이 아니라 가장 느린 가지에 묶입니다.
+def gather_record(isbn, reg_mark="", reg_no="", copy_symbol="", offline_653=False,
+                  series_kdc="", series_653="", series_name="", budget=None, convert=True, series_rep=False):
+    """네트워크 단계: 레코드 하나에 필요한 모든 상류 응답을 모아 build_marc_record 인자(dict)로 돌려줍니다.
+    budget(초)이 있으면 알라딘 이후 보조 필드는 그 안에 온 것만 씁니다.
+    convert=False(미리받기)면 상류 응답만 스냅샷에 두고 변환 행(소장 정보)은 남기지 않습니다."""
+    deadline = time.monotonic() + budget if budget else None
+    # 1) 알라딘 + (옵션) 국중 부가기호 동시 요청
+    stats = pipeline_stats()
+    future_aladin = submit_task(stats.observe, "aladin", fetch_aladin_metadata, isbn)
+    future_nlk    = submit_task(stats.observe, "nlk", fetch_nlk_doc, isbn)
+    try:
+        meta = future_aladin.result()
+    except Exception as e:
+        st.error(f"🚨 알라딘API 오류: {e}")
+        return None
+
+    # 상품 페이지 크롤링은 API에 정가가 없을 때만 (원제는 subInfo.originalTitle로 충분)
+    future_page = None if meta["price"] else submit_task(crawl_aladin_original_and_price, isbn)
+
+    # KDC·653 (스트리밍 중간 결과는 자리표시자에) — 지난 스냅샷에서 확정된 값이 있으면 그대로
+    previous = _snapshot_store().get(isbn)
+    known = settled_llm(previous)
+    live_653 = st.empty()
+    kdc, gpt_653, missing = enrich_kdc_653(
+        isbn, meta["title"] or "제목없음", meta["author"] or "저자미상", meta["category"],
+        meta["description"], meta["toc"],
+        offline_653=offline_653, series_kdc=series_kdc, series_653=series_653,
+        on_partial=lambda kws: live_653.caption(f"🏷️ 653 생성 중… {' '.join(kws)}"),
+        deadline=deadline, known=known, series_rep=series_rep,
+    )
+    live_653.empty()
+    # 로컬 추출 653(오프라인, 형제 권의 대표권+로컬 보충)은 확정하지 않음 — 다음 변환·보강에서 다시
+    local_653 = offline_653 or ((series_kdc or series_653) and not series_rep)
+
+    nlk_doc = _result_by(future_nlk, deadline, isbn, "020$g")   # 검색 결과 없음 {} / 지연·차단 None
+    if nlk_doc is None:
+        missing.insert(0, "020$g")
+    page = (_result_by(future_page, deadline, isbn, "page", park=False) or {}) if future_page is not None else {}
+    late = _late_results()
+    for field in ("020$g", "056", "653"):        # 이번에 채운 필드의 지난 늦은 결과는 더 쓸 일이 없음
+        if field not in missing:
+            late.pop((str(isbn).strip(), field), None)
+
+    # 상류 원본 응답은 스냅샷에 남겨 두고, 규칙이 바뀌면 API 없이 재생성합니다
+    payload = {
+        "isbn": isbn, "aladin": meta["item"], "nlk": nlk_doc, "page": page,
+        "llm": {"kdc": kdc, "kw653": gpt_653 or "",
+                "settled": [f for f in ("056", "653") if f not in missing
+                            and (f == "056" or not local_653 or "kw653" in known)]},
+        "series_name": series_name,
+        "missing": missing,             # 차단·실패로 생략된 필드(보강 대상)
+        "date_entered": (previous or {}).get("date_entered") or today_yymmdd(),   # 008/00-05: 처음 입력한 날
+    }
+    holding = {"reg_mark": reg_mark, "reg_no": reg_no, "copy_symbol": copy_symbol}
+    _snapshot_store().put(payload)
+    if convert:
+        _snapshot_store().add_conversion(isbn, **holding)
+    if missing:
+        backfill_queue().push(isbn, missing)
+    return job_from_snapshot(payload, meta=meta, holding=holding)
+
+def settled_llm(payload) -> dict:
+    """지난 스냅샷의 KDC/653 중 확정된 것만 (빠졌던 필드·오프라인 로컬 653은 제외)"""
+    llm = (payload or {}).get("llm") or {}
+    settled = llm.get("settled") or []
+    known = {}
+    if "056" in settled and llm.get("kdc") not in (None, "", "000"):
+        known["kdc"] = llm["kdc"]
+    if "653" in settled and llm.get("kw653"):
+        known["kw653"] = llm["kw653"]
+    return known
+
+class _DegradedRecord(Exception):
+    """필드가 빠진 레코드는 예외로 넘겨 st.cache_data에 남기지 않습니다(다음엔 다시 시도)."""
+
+    def __init__(self, marc, missing, conflicts=""):
+        super().__init__(marc)
+        self.marc, self.missing, self.conflicts = marc, missing, conflicts
+
+# 완성된 MARC 문자열 캐시는 메타데이터 필드별 신선 기간 중 가장 짧은 것만큼만 —
+# 그 뒤에는 stale-while-revalidate로 새로 받은 정가·총서 정보가 출력에 반영됩니다.
+MARC_OUTPUT_TTL = min(sec for policy in METADATA_POLICIES.values() for sec in policy.values())
+
+@st.cache_data(show_spinner=False, ttl=MARC_OUTPUT_TTL)
+def _fetch_book_data_cached(isbn, reg_mark, reg_no, copy_symbol, offline_653,
+                            series_kdc, series_653, series_name, budget, series_rep):
+    job = gather_record(isbn, reg_mark, reg_no, copy_symbol, offline_653,
+                        series_kdc, series_653, series_name, budget, series_rep=series_rep)
+    if not job:
+        return "", ""
+    f020 = build_020_batch([job])[0]
+    marc = build_marc_record(**job, f020=f020)
+    if job["missing"]:
+        raise _DegradedRecord(marc, job["missing"], f020["conflicts"])
+    return marc, f020["conflicts"]
+
+def fetch_book_data_from_aladin(isbn, reg_mark="", reg_no="", copy_symbol="", offline_653=False,
+                                series_kdc="", series_653="", series_name="", budget=None, series_rep=False):
+    try:
+        marc, conflicts = _fetch_book_data_cached(isbn, reg_mark, reg_no, copy_symbol, offline_653,
+                                                  series_kdc, series_653, series_name, budget, series_rep)
+    except _DegradedRecord as e:
+        st.caption(f"⏳ {isbn}: {', '.join(e.missing)} 생략 — 나중에 보강 대상")
+        marc, conflicts = e.marc, e.conflicts
+    if conflicts:
+        st.caption(f"⚠️ {isbn}: 020 {conflicts.replace(';', ', ')}")
+    return marc
+
+
+# 🗄️ 상류 응답 스냅샷 — 알라딘 item / 국중 문서 / 크롤링 / LLM 결과를 ISBN별로 압축 저장
+#    상류 응답은 ISBN별 하나, 소장(049) 정보는 변환한 행마다 따로(conversion 테이블) —
+#    같은 ISBN의 복본은 행이 여럿이고, 미리받기만 한(입고 안 된) ISBN은 행이 없습니다.
+HOLDING_FIELDS = ("reg_mark", "reg_no", "copy_symbol")
+
+def _legacy_holding(payload: dict):
+    """예전 스냅샷(payload 안 holding)에서 옮길 소장 정보. 비어 있으면(미리받기 등) None"""
+    holding = payload.pop("holding", None) or {}
+    return holding if any(holding.get(f) for f in HOLDING_FIELDS) else None
+
+class SnapshotStore:
+    """_cache_db() 안의 snapshot 테이블(payload는 zlib 압축 JSON 한 덩어리) + conversion 테이블"""
+
+    def __init__(self, db):
+        self.conn, self.lock = db["conn"], db["lock"]
+        with self.lock:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS snapshot ("
+                " isbn TEXT PRIMARY KEY, payload BLOB, fetched_at REAL)"
+            )
+            migrate = self.conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type='table' AND name='conversion'"
+            ).fetchone() is None
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS conversion ("
+                " isbn TEXT, reg_mark TEXT, reg_no TEXT, copy_symbol TEXT, converted_at REAL,"
+                " PRIMARY KEY (isbn, reg_mark, reg_no, copy_symbol))"
+            )
+            if migrate:
+                for payload in self.iter_payloads():
+                    holding = _legacy_holding(payload)
+                    if holding:
+                        self._add_conversion(payload["isbn"], **holding)
+            self.conn.commit()
+
+    def _add_conversion(self, isbn, reg_mark="", reg_no="", copy_symbol=""):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO conversion VALUES (?,?,?,?,?)",
+            (str(isbn).strip(), str(reg_mark or ""), str(reg_no or ""), str(copy_symbol or ""), time.time()),
+        )
+
+    def add_conversion(self, isbn, reg_mark="", reg_no="", copy_symbol=""):
+        """변환한 행(ISBN + 소장 정보) 하나를 남깁니다. 같은 행은 한 번만."""
+        with self.lock:
+            self._add_conversion(isbn, reg_mark, reg_no, copy_symbol)
+            self.conn.commit()
+
+    def conversions(self, isbn) -> list:
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT reg_mark, reg_no, copy_symbol FROM conversion WHERE isbn=? ORDER BY converted_at",
+                (str(isbn).strip(),),
+            ).fetchall()
+        return [dict(zip(HOLDING_FIELDS, row)) for row in rows]
+
+    def conversion_count(self) -> int:
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM conversion").fetchone()[0]
+
+    def iter_conversions(self, batch=2000):
+        """(isbn, 소장 정보) — 변환 순서대로"""
+        last = 0
+        while True:
+            with self.lock:
+                rows = self.conn.execute(
+                    "SELECT rowid, isbn, reg_mark, reg_no, copy_symbol FROM conversion"
+                    " WHERE rowid > ? ORDER BY rowid LIMIT ?", (last, batch)
+                ).fetchall()
+            if not rows:
+                return
+            for _, isbn, *holding in rows:
+                yield isbn, dict(zip(HOLDING_FIELDS, holding))
+            last = rows[-1][0]
+
+    @staticmethod
+    def _pack(payload: dict) -> bytes:
+        return zlib.compress(json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8"), 6)
+
+    @staticmethod
+    def _unpack(blob: bytes) -> dict:
+        return json.loads(zlib.decompress(blob))
+
+    def put(self, payload: dict):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO snapshot VALUES (?,?,?)",
+                (str(payload["isbn"]).strip(), self._pack(payload), time.time()),
+            )
+            self.conn.commit()
+
+    def get(self, isbn):
+        with self.lock:
+            row = self.conn.execute("SELECT payload FROM snapshot WHERE isbn=?", (str(isbn).strip(),)).fetchone()
+        return self._unpack(row[0]) if row else None
+
+    def count(self) -> int:
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM snapshot").fetchone()[0]
+
+    def iter_payloads(self, batch=2000):
+        last = ""
+        while True:
+            with self.lock:
+                rows = self.conn.execute(
+                    "SELECT isbn, payload FROM snapshot WHERE isbn > ? ORDER BY isbn LIMIT ?", (last, batch)
+                ).fetchall()
+            if not rows:
+                return
+            for isbn, blob in rows:
+                yield self._unpack(blob)
+            last = rows[-1][0]
+
+    def export_jsonl_gz(self, fileobj):
+        with gzip.GzipFile(fileobj=fileobj, mode="wb") as gz:
+            for payload in self.iter_payloads():
+                payload["conversions"] = self.conversions(payload["isbn"])
+                gz.write(json.dumps(payload, ensure_ascii=False).encode("utf-8") + b"\n")
+
+    def import_jsonl_gz(self, fileobj) -> int:
+        n = 0
+        with gzip.GzipFile(fileobj=fileobj, mode="rb") as gz, self.lock:
+            for line in gz:
+                if line.strip():
+                    payload = json.loads(line)
+                    holdings = payload.pop("conversions", None)
+                    legacy = _legacy_holding(payload)
+                    for holding in holdings if holdings is not None else filter(None, [legacy]):
+                        self._add_conversion(payload["isbn"], **holding)
+                    self.conn.execute(
+                        "INSERT OR REPLACE INTO snapshot VALUES (?,?,?)",
+                        (str(payload["isbn"]).strip(), self._pack(payload), time.time()),
+                    )
+                    n += 1
+            self.conn.commit()
+        return n
+
+@st.cache_resource
+def _snapshot_store():
+    return SnapshotStore(_cache_db())
+
+def job_from_snapshot(payload: dict, meta=None, holding=None) -> dict:
+    """스냅샷 payload(+ 변환 행의 소장 정보) → build_marc_record 인자(dict). 네트워크를 쓰지 않습니다."""
+    isbn = payload["isbn"]
+    llm = payload.get("llm") or {}
+    return {
+        "isbn": isbn,
+        "meta": meta if meta is not None else parse_aladin_item(isbn, payload.get("aladin") or {}),
+        "add_code": (payload.get("nlk") or {}).get("EA_ADD_CODE", ""),
+        "nlk": payload.get("nlk") or {},
+        "page": payload.get("page") or {},
+        "kdc": llm.get("kdc", ""),
+        "kw653": llm.get("kw653") or None,
+        "series_name": payload.get("series_name", ""),
+        "missing": list(payload.get("missing") or []),
+        "date_entered": payload.get("date_entered"),
+        **(holding or {}),
+    }
+
+def rebuild_from_snapshot(isbns=None, processes=None) -> list:
+    """스냅샷만으로 MARC 재생성(008/041/546 등 규칙 변경 반영). 변환한 행(복본마다 049)마다 하나씩,
+    isbns가 없으면 전체. 미리받기만 한 ISBN은 변환 행이 없으므로 나오지 않습니다."""
+    store = _snapshot_store()
+    if isbns is None:
+        rows = store.iter_conversions()
+    else:
+        rows = ((isbn, holding) for isbn in isbns for holding in store.conversions(isbn))
+    jobs = []
+    for isbn, holding in rows:
+        payload = store.get(isbn)
+        if payload is not None:
+            jobs.append(job_from_snapshot(payload, holding=holding))
+    return assemble_marc_batch(jobs, processes=processes)
+
+
+# ⏳ 보강 대기열 — 예산 초과·차단으로 빠진 필드를 뒤에서 채우고, 고친 레코드를 델타 파일로 냅니다
+BACKFILL_INTERVAL_SEC = float(os.environ.get("ISBN2MARC_BACKFILL_INTERVAL", "30"))
+BACKFILL_MAX_ATTEMPTS = 5
+BACKFILL_DELTA_PATH = os.path.join(CACHE_DIR, "backfill_delta.txt")
+
+class BackfillQueue:
+    """_cache_db() 안의 backfill 테이블: ISBN별로 아직 못 채운 필드 목록"""
+
+    def __init__(self, db):
+        self.conn, self.lock = db["conn"], db["lock"]
+        with self.lock:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS backfill ("
+                " isbn TEXT PRIMARY KEY, fields TEXT, enqueued REAL,"
+                " attempts INTEGER DEFAULT 0, last_error TEXT DEFAULT '')"
+            )
+            self.conn.commit()
+
+    def push(self, isbn, fields):
+        isbn = str(isbn).strip()
+        with self.lock:
+            row = self.conn.execute("SELECT fields FROM backfill WHERE isbn=?", (isbn,)).fetchone()
+            merged = list(dict.fromkeys((json.loads(row[0]) if row else []) + list(fields)))
+            self.conn.execute(
+                "INSERT OR REPLACE INTO backfill (isbn, fields, enqueued, attempts) VALUES (?,?,?,0)",
+                (isbn, json.dumps(merged), time.time()),
+            )
+            self.conn.commit()
+
+    def pending(self, limit=50) -> list:
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT isbn, fields FROM backfill WHERE attempts < ? ORDER BY enqueued LIMIT ?",
+                (BACKFILL_MAX_ATTEMPTS, limit),
+            ).fetchall()
+        return [(isbn, json.loads(fields)) for isbn, fields in rows]
+
+    def settle(self, isbn, left, error=""):
+        with self.lock:
+            if left:
+                self.conn.execute(
+                    "UPDATE backfill SET fields=?, attempts=attempts+1, last_error=? WHERE isbn=?",
+                    (json.dumps(left), error, isbn),
+                )
+            else:
+                self.conn.execute("DELETE FROM backfill WHERE isbn=?", (isbn,))
+            self.conn.commit()
+
+    def count(self) -> int:
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM backfill").fetchone()[0]
+
+    def rows(self, limit=200) -> list:
+        with self.lock:
+            return self.conn.execute(
+                "SELECT isbn, fields, attempts, last_error FROM backfill ORDER BY enqueued LIMIT ?", (limit,)
+            ).fetchall()
+
+@st.cache_resource
+def backfill_queue():
+    return BackfillQueue(_cache_db())
+
+def backfill_record(isbn, fields) -> list:
+    """스냅샷을 불러와 빠진 필드만 다시 받아 채웁니다. 남은 필드 목록을 돌려줍니다."""
+    store = _snapshot_store()
+    payload = store.get(isbn)
+    if payload is None:
+        return []
+    meta = parse_aladin_item(isbn, payload.get("aladin") or {})
+    llm = payload.setdefault("llm", {})
+    late = _late_results()
+    left = []
+    for field in fields:
+        if field == "020$g":
+            doc = late.pop((isbn, field), None) or fetch_nlk_doc(isbn)
+            if doc is None:
+                left.append(field)
+            else:
+                payload["nlk"] = doc
+        elif field == "056":
+            kdc = late.pop((isbn, field), None) or recommend_kdc(meta["title"], meta["author"], api_key=openai_key)
+            if kdc in ("", "000"):
+                left.append(field)
+            else:
+                llm["kdc"] = kdc
+                llm["settled"] = sorted(set(llm.get("settled") or []) | {"056"})
+        elif field == "653":
+            kw653 = late.pop((isbn, field), None) or generate_653_with_gpt(
+                meta["category"], meta["title"], meta["authors"], meta["description"], meta["toc"], max_keywords=7,
+            )
+            if not kw653:
+                left.append(field)
+            else:
+                llm["kw653"] = kw653
+                llm["settled"] = sorted(set(llm.get("settled") or []) | {"653"})
+
+    payload["missing"] = left
+    store.put(payload)
+    holdings = store.conversions(isbn)           # 미리받기만 한 ISBN은 내보낸 레코드가 없으므로 델타도 없음
+    if len(left) < len(fields) and holdings:
+        with open(BACKFILL_DELTA_PATH, "a", encoding="utf-8") as f:
+            for holding in holdings:                # 복본마다 049가 다르므로 변환 행마다
+                f.write(build_marc_record(**job_from_snapshot(payload, meta=meta, holding=holding)) + "\n\n")
+    return left
+
+def run_backfill_pass(limit=50) -> dict:
+    queue = backfill_queue()
+    done = still = 0
+    for isbn, fields in queue.pending(limit):
+        try:
+            left = backfill_record(isbn, fields)
+            queue.settle(isbn, left)
+        except Exception as e:
+            left = fields
+            queue.settle(isbn, left, f"{type(e).__name__}: {e}"[:200])
+        done += not left
+        still += bool(left)
+    return {"완료": done, "남음": still}
+
+@st.cache_resource
+def _backfill_worker():
+    """프로세스당 하나: BACKFILL_INTERVAL_SEC마다 대기열을 한 번씩 처리"""
+    stop = threading.Event()
+
+    def loop():
+        while not stop.wait(BACKFILL_INTERVAL_SEC):
+            try:
+                run_backfill_pass()
+            except Exception:
+                pass
+
+    thread = threading.Thread(target=loop, name="isbn2marc-backfill", daemon=True)
+    thread.start()
+    return {"thread": thread, "stop": stop}
+
+
+# 📥 입고 전 미리 받기 — ISBN 목록으로 알라딘·국중·LLM 보강을 천천히 돌려 영구 캐시를 채웁니다
+#    입고 당일 변환은 메타데이터 캐시·보강 캐시 조회만으로 끝납니다.
+PREFETCH_RATE = float(os.environ.get("ISBN2MARC_PREFETCH_RATE", "1"))     # 초당 ISBN
+
+def read_isbn_file(data: bytes, name="") -> list:
+    """isbn_template.csv(ISBN 열) 또는 한 줄에 하나씩인 TXT → ISBN 목록(중복 제거, 순서 유지)"""
+    text = data.decode("utf-8-sig", errors="ignore")
+    if name.lower().endswith(".csv"):
+        df = pd.read_csv(io.StringIO(text), dtype=str)
+        values = (df["ISBN"] if "ISBN" in df.columns else df.iloc[:, 0]).dropna()
+    else:
+        values = text.split()
+    isbns = (re.sub(r"[^0-9Xx]", "", v) for v in values)
+    return list(dict.fromkeys(i for i in isbns if len(i) in (10, 13)))
+
+class PrefetchJob:
+    """백그라운드 스레드 하나로 ISBN을 rate건/초씩, 대화형 작업이 풀을 쓰는 동안은 쉬면서 처리"""
+
+    def __init__(self, isbns, rate=PREFETCH_RATE, offline_653=False):
+        self.isbns = list(isbns)
+        self.rate = rate
+        self.offline_653 = offline_653
+        self.stage = "대기"
+        self.done = self.failed = 0
+        self.started = time.time()
+        self.finished = None
+        self._stop = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="isbn2marc-prefetch", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def cancel(self):
+        self._stop.set()
+
+    def _pace(self) -> bool:
+        """다음 ISBN 차례까지 기다림. 취소되면 False"""
+        if self._stop.wait(1.0 / max(self.rate, 0.01)):
+            return False
+        while any(p["대기열"] > 0 for p in pool_stats() if p["풀"] in ("http", "llm")):
+            if self._stop.wait(0.5):
+                return False
+        return True
+
+    def _run(self):
+        try:
+            # 1) 알라딘·국중 응답 → 메타데이터 캐시
+            self.stage = "메타데이터"
+            for isbn in self.isbns:
+                if not self._pace():
+                    return
+                self.failed += warm_metadata([isbn])["실패"] > 0
+                self.done += 1
+            # 2) 총서 묶음(대표권 보강) → 3) 권별 KDC/653 → 보강 캐시·스냅샷
+            self.stage = "총서 묶음"
+            plan = plan_series_batch([[isbn] for isbn in self.isbns], self.offline_653, pace=self._pace)
+            if self._stop.is_set():
+                return
+            self.stage = "보강"
+            for isbn, shared in zip(self.isbns, plan):
+                if not self._pace():
+                    return
+                try:
+                    job = gather_record(isbn, "", "", "", self.offline_653, **shared, convert=False)
+                    self.failed += job is None or bool(job.get("missing"))
+                except Exception:
+                    self.failed += 1
+                self.done += 1
+            self.stage = "완료"
+        finally:
+            if self.stage != "완료":
+                self.stage = "취소" if self._stop.is_set() else "오류"
+            self.finished = time.time()
+
+    def state(self) -> dict:
+        total = len(self.isbns) * 2
+        return {
+            "시작": datetime.datetime.fromtimestamp(self.started).strftime("%m-%d %H:%M"),
+            "ISBN": len(self.isbns),
+            "단계": self.stage,
+            "진행": f"{self.done:,}/{total:,}",
+            "실패": self.failed,
+            "소요(초)": round((self.finished or time.time()) - self.started),
+        }
+
+@st.cache_resource
+def _prefetch_jobs():
+    return []
+
+def start_prefetch(isbns, rate=PREFETCH_RATE, offline_653=False) -> PrefetchJob:
+    job = PrefetchJob(isbns, rate, offline_653).start()
+    _prefetch_jobs().append(job)
+    return job
+
+
+# 📊 수집 메타데이터 열 저장소 (Parquet) — 10만 건 이상을 낮은 메모리로 훑고 거르기
+#    pyarrow는 streamlit 의존성으로 함께 설치되지만, 없으면 이 기능만 꺼집니다.
+HARVEST_PATH = os.path.join(CACHE_DIR, "harvest.parquet")
+HARVEST_FIELDS = [
+    # (열 이름, 스냅샷 payload에서 꺼내는 함수)
+    ("isbn",          lambda p: str(p["isbn"]).strip()),
+    ("title",         lambda p: p["aladin"].get("title", "")),
+    ("author",        lambda p: p["aladin"].get("author", "")),
+    ("publisher",     lambda p: p["aladin"].get("publisher", "")),
+    ("pubDate",       lambda p: p["aladin"].get("pubDate", "")),
+    ("categoryName",  lambda p: p["aladin"].get("categoryName", "")),
+    ("description",   lambda p: p["aladin"].get("description", "")),
+    ("toc",           lambda p: (p["aladin"].get("subInfo") or {}).get("toc", "")),
+    ("priceStandard", lambda p: int(p["aladin"].get("priceStandard") or 0)),
+    ("seriesName",    lambda p: (p["aladin"].get("seriesInfo") or {}).get("seriesName", "")),
+    ("volume",        lambda p: str((p["aladin"].get("seriesInfo") or {}).get("volume", "") or "")),
+    ("EA_ADD_CODE",   lambda p: (p.get("nlk") or {}).get("EA_ADD_CODE", "")),
+]
+
+def _harvest_schema():
+    return pa.schema([(name, pa.int64() if name == "priceStandard" else pa.string())
+                      for name, _ in HARVEST_FIELDS])
+
+def export_harvest_parquet(path=HARVEST_PATH, row_group_size=20000) -> int:
+    """스냅샷 → Parquet(zstd, 행 그룹 단위 스트리밍 기록). 기록한 행 수를 돌려줍니다."""
+    if pa is None:
+        raise RuntimeError("pyarrow가 설치되어 있지 않습니다.")
+    schema = _harvest_schema()
+    tmp = path + ".tmp"
+    n = 0
+    with pq.ParquetWriter(tmp, schema, compression="zstd") as writer:
+        cols = {name: [] for name, _ in HARVEST_FIELDS}
+        for payload in _snapshot_store().iter_payloads():
+            payload.setdefault("aladin", {})
+            for name, get in HARVEST_FIELDS:
+                cols[name].append(get(payload))
+            n += 1
+            if len(cols["isbn"]) >= row_group_size:
+                writer.write_table(pa.Table.from_pydict(cols, schema=schema))
+                cols = {name: [] for name, _ in HARVEST_FIELDS}
+        if cols["isbn"]:
+            writer.write_table(pa.Table.from_pydict(cols, schema=schema))
+    os.replace(tmp, path)
+    return n
+
+def read_harvest(columns=None, path=HARVEST_PATH):
+    """메모리 맵으로 필요한 열만 읽습니다(없으면 None)."""
+    if pa is None or not os.path.exists(path):
+        return None
+    return pq.read_table(path, columns=columns, memory_map=True)
 
+def harvest_isbns_by_category(keyword: str, path=HARVEST_PATH) -> list:
+    """categoryName에 keyword가 들어간 ISBN 목록 (isbn·categoryName 두 열만 읽어 벡터 연산으로 거름)"""
+    table = read_harvest(["isbn", "categoryName"], path)
+    if table is None:
+        return []
+    mask = pc.match_substring(table["categoryName"], keyword)
+    return table.filter(mask)["isbn"].to_pylist()
+
+
+# 🧮 CPU 단계 병렬화 — 이미 받아 둔 메타데이터로 MARC 조립만 여러 코어에 나눕니다
+#    (008 규칙 변경 후 전체 재생성 등). fork로 띄우므로 작업 목록은 피클링하지 않고,
+#    결과 문자열만 파이프로 돌려받아 원래 순서대로 이어 붙입니다. 샤드가 제시간에 안 오면 그 몫은 직접 조립합니다.
+CPU_STAGE_MIN_PER_PROCESS = 500     # 이보다 적으면 프로세스 띄우는 비용이 더 큼
+CPU_STAGE_SHARD_TIMEOUT = 30.0      # 초 + 샤드 레코드당 10ms. 넘기면 남은 샤드는 이 프로세스에서 직접 조립
+
+def _assemble_range(jobs, start, stop, authority=None):
+    out = []
+    for job in jobs[start:stop]:
+        try:
+            out.append(build_marc_record(**job, authority=authority))
+        except Exception as e:
+            out.append(f"# ⚠️ {job.get('isbn')}: {e}")
+    return out
+
+def _assemble_shard(jobs, start, stop, conn, index):
+    # 서버는 스레드가 많아 fork 순간 잡혀 있던 st.cache_resource 잠금이 자식에서 안 풀릴 수 있으므로,
+    # 자식은 부모가 넘겨준 전거 색인 객체를 바로 씁니다(getter를 부르지 않음).
+    conn.send(_assemble_range(jobs, start, stop, index))
+    conn.close()
+
+def _shard_result(proc, recv, timeout):
+    """샤드 결과. 시간 안에 안 오거나 자식이 죽었으면 None"""
+    deadline = time.monotonic() + timeout
+    while True:
+        if recv.poll(min(0.1, max(0.0, deadline - time.monotonic()))):
+            try:
+                return recv.recv()
+            except EOFError:
+                return None
+        if time.monotonic() >= deadline or (not proc.is_alive() and not recv.poll(0)):
+            return None
+
+def register_authority(job):
+    """build_marc_record가 찾을 전거 표목(저자·총서)을 미리 등록합니다.
+    fork 전에 부모에서 불러 두면 샤드마다 처음 보는 변이형의 표목을 따로 고르는 일이 없습니다."""
+    index = authority_index()
+    for c in parse_contributors(job["meta"]["author"]):
+        index.heading("name", c.heading)
+    name = (job.get("series_name") or job["meta"]["series_name"]).strip()
+    if name:
+        index.heading("series", name)
+
+def assemble_marc_batch(jobs, processes=None):
+    """build_marc_record 인자(dict) 목록 → 같은 순서의 MARC 문자열 목록"""
+    jobs = list(jobs)
+    todo = [i for i, job in enumerate(jobs) if job.get("f020") is None]     # 020은 배치 전체를 한 번에
+    for i, f020 in zip(todo, build_020_batch(jobs[i] for i in todo)):
+        jobs[i] = {**jobs[i], "f020": f020}
+    n = processes or os.cpu_count() or 1
+    n = min(n, len(jobs) // CPU_STAGE_MIN_PER_PROCESS) if processes is None else min(n, len(jobs))
+    if n <= 1 or "fork" not in mp.get_all_start_methods():
+        return _assemble_range(jobs, 0, len(jobs))
+
+    for job in jobs:                   # 전거 표목은 020처럼 부모에서 먼저 확정
+        register_authority(job)
+    index = authority_index()
+    ctx = mp.get_context("fork")
+    step = -(-len(jobs) // n)
+    shards = []
+    for start in range(0, len(jobs), step):
+        recv, send = ctx.Pipe(duplex=False)
+        proc = ctx.Process(target=_assemble_shard, args=(jobs, start, start + step, send, index), daemon=True)
+        proc.start()
+        send.close()
+        shards.append((proc, recv, start))
+
+    out = []
+    deadline = time.monotonic() + CPU_STAGE_SHARD_TIMEOUT + 0.01 * step     # 샤드는 동시에 돌므로 기한도 하나
+    for proc, recv, start in shards:   # 샤드 순서 = 원래 순서
+        stop = min(start + step, len(jobs))
+        part = _shard_result(proc, recv, deadline - time.monotonic())
+        if part is None:               # 자식이 멈췄거나 죽음 → 이 샤드는 여기서 직접
+            proc.kill()
+            part = _assemble_range(jobs, start, stop, index)
+        out.extend(part)
+        proc.join()
+        recv.close()
+    return out
+
+
+# 🗃️ 대용량 결과 스풀 — 결과를 메모리에 모아 두지 않고 끝나는 대로 디스크에 이어 씁니다
+LARGE_BATCH_ROWS = 200      # 이 행 수 이상이면 대용량 모드를 기본으로
+PREVIEW_PAGE_SIZE = 20
+SPOOL_DIR = os.path.join(CACHE_DIR, "spool")
+SPOOL_ORPHAN_AGE_SEC = 12 * 3600    # 서버 시작 때 이보다 오래된 스풀 파일은 이전 실행이 남긴 것으로 보고 지움
+
+def _spool_files(path) -> tuple:
+    return path, path + ".gz", path + ".zip"
+
+def _remove_spool_files(path):
+    for p in _spool_files(path):
+        if os.path.exists(p):
+            os.remove(p)
+
+def _spool_download_path(path, compression="없음") -> str:
+    """압축본은 처음 요청될 때 한 번만 디스크에 만듭니다."""
+    if compression == "gzip":
+        target = path + ".gz"
+        if not os.path.exists(target):
+            with open(path, "rb") as src, gzip.open(target, "wb") as dst:
+                shutil.copyfileobj(src, dst)
+        return target
+    if compression == "zip":
+        target = path + ".zip"
+        if not os.path.exists(target):
+            with zipfile.ZipFile(target, "w", zipfile.ZIP_DEFLATED) as zf:
+                zf.write(path, arcname="marc_output.txt")
+        return target
+    return path
+
+def _read_file(path) -> bytes:
+    if not os.path.exists(path):
+        return b""
+    with open(path, "rb") as f:
+        return f.read()
+
+def spool_download(path, compression="없음"):
+    """st.download_button용 지연 데이터: 누를 때만 (압축하고) 읽습니다. 다시 그릴 때마다 메모리에 올리지 않음.
+    스풀 객체 대신 경로만 잡아 세션이 끝나면 스풀이 정리될 수 있게 합니다."""
+    return lambda: _read_file(_spool_download_path(path, compression)) if os.path.exists(path) else b""
+
+@st.cache_resource
+def _sweep_spool_dir():
+    """서버 시작 시 한 번: 끝난 세션·비정상 종료가 남긴 스풀 파일 정리"""
+    if not os.path.isdir(SPOOL_DIR):
+        return 0
+    cutoff, removed = time.time() - SPOOL_ORPHAN_AGE_SEC, 0
+    for name in os.listdir(SPOOL_DIR):
+        path = os.path.join(SPOOL_DIR, name)
+        if name.startswith("marc_") and os.path.getmtime(path) < cutoff:
+            os.remove(path)
+            removed += 1
+    return removed
+
+class MarcSpool:
+    """MARC 레코드를 임시 파일에 이어 쓰고, 레코드별 (오프셋, 길이)만 메모리에 둡니다."""
+
+    SEPARATOR = b"\n\n"
+
+    def __init__(self, key):
+        os.makedirs(SPOOL_DIR, exist_ok=True)
+        fd, self.path = tempfile.mkstemp(prefix="marc_", suffix=".txt", dir=SPOOL_DIR)
+        os.close(fd)
+        # 세션이 끝나 session_state와 함께 스풀이 사라지면(또는 서버 종료 시) 파일도 지움
+        self._cleanup = weakref.finalize(self, _remove_spool_files, self.path)
+        self.key = key
+        self.offsets = []
+        self.failed = 0
+        self.degraded = 0       # 차단·실패로 필드가 빠진 레코드(보강 대상)
+        self.conflicts = []     # (ISBN, 020 엔진 충돌) — 충돌이 있는 레코드만
+        self._size = 0
+
+    def append(self, marc: str):
+        data = marc.encode("utf-8")
+        with open(self.path, "ab") as f:
+            if self.offsets:
+                f.write(self.SEPARATOR)
+                self._size += len(self.SEPARATOR)
+            f.write(data)
+        self.offsets.append((self._size, len(data)))
+        self._size += len(data)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def pages(self, size=PREVIEW_PAGE_SIZE) -> int:
+        return max(1, -(-len(self.offsets) // size))
+
+    def page(self, index, size=PREVIEW_PAGE_SIZE) -> list:
+        out = []
+        with open(self.path, "rb") as f:
+            for offset, length in self.offsets[index * size:(index + 1) * size]:
+                f.seek(offset)
+                out.append(f.read(length).decode("utf-8"))
+        return out
+
+    def download_path(self, compression="없음") -> str:
+        return _spool_download_path(self.path, compression)
+
+    def discard(self):
+        self._cleanup()
+
+
+# 📈 배치 진행 화면 — 진행/속도/남은 시간 + 상류별 지연·오류 + 캐시 적중률
+PROGRESS_REFRESH_SEC = 0.5
+
+def _fmt_eta(seconds):
+    if seconds != seconds or seconds == float("inf"):   # NaN/무한
+        return "—"
+    return str(datetime.timedelta(seconds=int(seconds)))
+
+def render_batch_progress(box, done, total, started, baseline):
+    elapsed = max(time.monotonic() - started, 1e-9)
+    rate = done / elapsed
+    eta = (total - done) / rate if rate else float("nan")
+    stats = pipeline_stats()
+    hits = stats.hit_rates(baseline)
+    with box.container():
+        st.progress(done / max(total, 1), text=f"{done:,}/{total:,}행")
+        c1, c2, c3, c4 = st.columns(4)
+        c1.metric("진행", f"{done:,}/{total:,}")
+        c2.metric("처리 속도", f"{rate:.2f}건/초")
+        c3.metric("남은 시간", _fmt_eta(eta))
+        c4.metric("캐시 적중률", f"{sum(hits.values()) / len(hits):.0%}" if hits else "—")
+        rows = stats.upstream_rows(baseline)
+        if rows:
+            st.dataframe(pd.DataFrame(rows), hide_index=True)
+        if hits:
+            st.caption(" · ".join(f"{n} {r:.0%}" for n, r in sorted(hits.items())))
+        tripped = [b.state() for b in _circuit_breakers().values() if b.state()["상태"] != "정상"]
+        for b in tripped:
+            st.warning(f"🔌 {b['상류']} {b['상태']} — {b['남은 차단(초)']}초 남음, {b['건너뜀']}건 건너뜀")
+
+class BatchProgress:
+    """배치 루프에서 한 행 끝날 때마다 step() — 화면 갱신은 PROGRESS_REFRESH_SEC 간격으로만"""
+
+    def __init__(self, total):
+        self.total = total
+        self.done = 0
+        self.box = st.empty()
+        self.started = time.monotonic()
+        self.baseline = pipeline_stats().counters()
+        self._drawn = 0.0
+
+    def step(self, n=1):
+        self.done += n
+        now = time.monotonic()
+        if self.done >= self.total or now - self._drawn >= PROGRESS_REFRESH_SEC:
+            self._drawn = now
+            render_batch_progress(self.box, self.done, self.total, self.started, self.baseline)
 
 
 # 🎛️ Streamlit UI
@@ -616,19 +3041,174 @@ if uploaded_file:
     else:
         st.error("❌ 필요한 열이 없습니다: ISBN, 등록기호, 등록번호, 별치기호")
 
-if isbn_list:
+offline_653 = st.sidebar.checkbox("🔌 오프라인 653 (GPT 없이 로컬 추출)", value=False)
+large_mode = st.sidebar.checkbox("🗃️ 대용량 모드 (디스크 스풀 + 미리보기)",
+                                 value=len(isbn_list) >= LARGE_BATCH_ROWS)
+budget = st.sidebar.number_input("⏱️ 레코드당 지연 예산(초, 0=무제한)", min_value=0.0,
+                                 value=RECORD_BUDGET_SEC, step=1.0) or None
+_backfill_worker()
+_sweep_spool_dir()
+
+if isbn_list and large_mode:
+    st.subheader("📄 MARC 출력 (대용량 모드)")
+    batch_key = hashlib.sha1(repr((isbn_list, offline_653, budget)).encode("utf-8")).hexdigest()
+    spool = st.session_state.get("marc_spool")
+    if spool is None or spool.key != batch_key:
+        # 같은 입력으로 다시 그릴 때(페이지 이동 등)는 스풀을 재사용하고 다시 변환하지 않습니다
+        if spool is not None:
+            spool.discard()
+        spool = MarcSpool(batch_key)
+        progress = BatchProgress(len(isbn_list))
+        series_plan = plan_series_with_progress(isbn_list, offline_653, budget)
+        chunk = []
+        for n, (row, shared) in enumerate(zip(isbn_list, series_plan), 1):
+            isbn, reg_mark, reg_no, copy_symbol = row
+            job = gather_record(isbn, reg_mark, reg_no, copy_symbol, offline_653, **shared, budget=budget)
+            if job:
+                chunk.append(job)
+                spool.degraded += bool(job["missing"])
+            else:
+                spool.failed += 1
+            if len(chunk) >= PREVIEW_PAGE_SIZE or n == len(isbn_list):
+                for job, f020 in zip(chunk, build_020_batch(chunk)):    # 020 등 배치 단계는 묶음 단위로
+                    job["f020"] = f020
+                    if f020["conflicts"]:
+                        spool.conflicts.append((job["isbn"], f020["conflicts"].replace(";", ", ")))
+                for marc in assemble_marc_batch(chunk, processes=1):
+                    spool.append(marc)
+                chunk = []
+            progress.step()
+        st.session_state["marc_spool"] = spool
+
+    c1, c2, c3, c4, c5 = st.columns(5)
+    c1.metric("입력 행", f"{len(isbn_list):,}")
+    c2.metric("생성 레코드", f"{len(spool):,}")
+    c3.metric("실패", f"{spool.failed:,}")
+    c4.metric("보강 대기", f"{spool.degraded:,}")
+    c5.metric("020 충돌", f"{len(spool.conflicts):,}")
+    if spool.conflicts:
+        with st.expander("⚠️ 020 충돌 (알라딘·국중 불일치, 형식 오류)"):
+            st.dataframe(pd.DataFrame(spool.conflicts, columns=["ISBN", "충돌"]), hide_index=True)
+
+    page_no = st.number_input("미리보기 페이지", min_value=1, max_value=spool.pages(), value=1)
+    for marc in spool.page(page_no - 1):
+        st.code(marc, language="text")
+
+    compression = st.radio("다운로드 형식", ["없음", "gzip", "zip"], horizontal=True)
+    ext = {"없음": ".txt", "gzip": ".txt.gz", "zip": ".zip"}[compression]
+    mime = {"없음": "text/plain", "gzip": "application/gzip", "zip": "application/zip"}[compression]
+    st.download_button("📦 모든 MARC 다운로드", data=spool_download(spool.path, compression),
+                       file_name=f"marc_output{ext}", mime=mime)
+
+elif isbn_list:
     st.subheader("📄 MARC 출력")
     marc_results = []
-    for row in isbn_list:
+    progress = BatchProgress(len(isbn_list)) if len(isbn_list) > 1 else None
+    series_plan = plan_series_with_progress(isbn_list, offline_653, budget) if len(isbn_list) > 1 else [{}]
+    for row, shared in zip(isbn_list, series_plan):
         isbn, reg_mark, reg_no, copy_symbol = row
-        marc = fetch_book_data_from_aladin(isbn, reg_mark, reg_no, copy_symbol)
+        marc = fetch_book_data_from_aladin(isbn, reg_mark, reg_no, copy_symbol, offline_653, **shared, budget=budget)
         if marc:
             st.code(marc, language="text")
             marc_results.append(marc)
+        if progress:
+            progress.step()
 
     full_text = "\n\n".join(marc_results)
     st.download_button("📦 모든 MARC 다운로드", data=full_text, file_name="marc_output.txt", mime="text/plain")
 
+# ⏳ 보강 대기열 — 예산 초과·차단으로 빠진 필드를 뒤에서 채웁니다
+with st.expander(f"⏳ 보강 대기열 ({backfill_queue().count():,}건)"):
+    st.caption(f"작업자가 {BACKFILL_INTERVAL_SEC:.0f}초마다 처리하고, 고친 레코드는 델타 파일에 쌓입니다.")
+    queued = backfill_queue().rows()
+    if queued:
+        st.dataframe(pd.DataFrame(queued, columns=["ISBN", "필드", "시도", "최근 오류"]), hide_index=True)
+    if st.button("▶️ 지금 보강"):
+        st.success(run_backfill_pass())
+    if os.path.exists(BACKFILL_DELTA_PATH):
+        st.download_button("📦 보강된 레코드(델타) 다운로드", data=functools.partial(_read_file, BACKFILL_DELTA_PATH),
+                           file_name="marc_backfill_delta.txt", mime="text/plain")
+        if st.button("🧹 델타 비우기"):
+            os.remove(BACKFILL_DELTA_PATH)
+
+# 🗄️ 스냅샷 재생성 — 저장된 상류 응답만으로 전체 MARC를 다시 만듭니다(API 호출 없음)
+with st.expander("🗄️ 스냅샷 재생성 (오프라인)"):
+    store = _snapshot_store()
+    st.caption(f"변환한 행: {store.conversion_count():,}건 (상류 응답 {store.count():,}건) · "
+               "008/041/546 규칙을 바꾼 뒤 API 없이 다시 생성합니다.")
+    if st.button("🔁 스냅샷 전체 재생성"):
+        t0 = time.perf_counter()
+        rebuilt = rebuild_from_snapshot()
+        elapsed = time.perf_counter() - t0
+        st.success(f"{len(rebuilt):,}건 재생성 ({len(rebuilt) / max(elapsed, 1e-9):,.0f}건/초)")
+        st.download_button("📦 재생성 MARC 다운로드", data="\n\n".join(rebuilt),
+                           file_name="marc_rebuild.txt", mime="text/plain")
+    if st.button("💾 스냅샷 내보내기 준비"):
+        snap_buf = io.BytesIO()
+        store.export_jsonl_gz(snap_buf)
+        st.download_button("💾 스냅샷 내보내기 (.jsonl.gz)", data=snap_buf.getvalue(),
+                           file_name="isbn2marc_snapshot.jsonl.gz", mime="application/gzip")
+    snap_file = st.file_uploader("📥 스냅샷 가져오기", type=["gz"], key="snapshot_import")
+    if snap_file and st.button("가져오기"):
+        st.success(f"{store.import_jsonl_gz(snap_file):,}건 가져옴")
+
+# 📊 수집 메타데이터 (Parquet) — 분류별로 골라 재생성
+with st.expander("📊 수집 메타데이터 열 저장소 (Parquet)"):
+    if pa is None:
+        st.info("pyarrow가 없어 열 저장소를 쓸 수 없습니다.")
+    else:
+        if st.button("🧱 스냅샷 → Parquet 갱신"):
+            st.success(f"{export_harvest_parquet():,}행 기록: {HARVEST_PATH}")
+        cat_kw = st.text_input("분류(categoryName) 포함어", placeholder="예: 한국소설")
+        if cat_kw.strip():
+            hits = harvest_isbns_by_category(cat_kw.strip())
+            st.caption(f"{len(hits):,}건 일치")
+            if hits and st.button("🔁 이 분류만 재생성"):
+                rebuilt = rebuild_from_snapshot(hits)
+                st.download_button("📦 재생성 MARC 다운로드", data="\n\n".join(rebuilt),
+                                   file_name="marc_rebuild_category.txt", mime="text/plain")
+
+# 🗂️ 전거 색인 (저자명·총서명 변이형 → 표목)
+with st.sidebar.expander("🗂️ 전거 색인"):
+    st.write(authority_index().stats())
+    authority_rows = authority_index().rows()
+    if authority_rows:
+        st.dataframe(pd.DataFrame(authority_rows, columns=["종류", "정규화 키", "표목"]), hide_index=True)
+
+# 🛠️ 관리: 대량 입고 전 메타데이터 캐시 예열
+with st.sidebar.expander("🛠️ 메타데이터 캐시 예열"):
+    st.dataframe(pd.DataFrame(metadata_cache().stats()), hide_index=True)
+    warm_text = st.text_area("ISBN 목록 (한 줄에 하나)", key="warm_isbns")
+    if st.button("🔥 예열 시작") and warm_text.strip():
+        warm_bar = st.progress(0.0)
+        warmed = warm_metadata(warm_text.split(),
+                               on_progress=lambda n, total: warm_bar.progress(n / total))
+        st.success(", ".join(f"{k} {v:,}" for k, v in warmed.items()))
+
+# 📥 입고 전 미리 받기 (백그라운드, 저속)
+with st.sidebar.expander("📥 입고 전 미리 받기"):
+    prefetch_file = st.file_uploader("ISBN 목록 (CSV 서식 또는 TXT)", type=["csv", "txt"], key="prefetch_file")
+    prefetch_rate = st.number_input("초당 ISBN", min_value=0.1, value=PREFETCH_RATE, step=0.5)
+    if prefetch_file and st.button("▶️ 미리 받기 시작"):
+        prefetch_isbns = read_isbn_file(prefetch_file.getvalue(), prefetch_file.name)
+        start_prefetch(prefetch_isbns, prefetch_rate, offline_653)
+        st.success(f"{len(prefetch_isbns):,}건 예약 — 화면을 닫아도 서버에서 계속 진행됩니다.")
+    jobs = _prefetch_jobs()
+    if jobs:
+        st.dataframe(pd.DataFrame([j.state() for j in jobs]), hide_index=True)
+        running = [j for j in jobs if j.finished is None]
+        if running and st.button("⏹️ 진행 중인 작업 취소"):
+            for j in running:
+                j.cancel()
+
+# ⚙️ 작업 풀 지표 (이번 실행까지 누적)
+with st.sidebar.expander("⚙️ 작업 풀 상태"):
+    st.dataframe(pd.DataFrame(pool_stats()), hide_index=True)
+    hedge_rows = hedge_controller().rows()
+    if hedge_rows:
+        st.caption("🪃 호스트별 지연·헤지 (p95 초과 시 중복 요청)")
+        st.dataframe(pd.DataFrame(hedge_rows), hide_index=True)
+
 # 📄 템플릿 예시 다운로드
 example_csv = "ISBN,등록기호,등록번호,별치기호\n9791173473968,JUT,12345,TCH\n"
 buffer = io.BytesIO()
@@ -0,0 +1,31 @@
+# 📥 입고 전 미리 받기: ISBN 목록(CSV 서식/TXT)으로 알라딘·국중·LLM 보강 캐시를 채웁니다
+#    실행: python 미리받기.py 다권반입테스트용.txt [--rate 0.5] [--offline-653]
+#    (.streamlit/secrets.toml 필요, 캐시 위치는 ISBN2MARC_CACHE_DIR)
+#    주의: `import app`은 Streamlit 페이지 스크립트 전체를 한 번 실행합니다(bare 모드 경고가 찍힘).
+#    그때 보강 대기열 작업자(_backfill_worker)와 스풀 정리도 이 프로세스에서 시작되므로,
+#    --rate를 넘는 호출이 섞이지 않게 대기열 작업자는 바로 멈춥니다(대기열은 서버가 처리).
+import argparse
+
+import app
+
+app._backfill_worker()["stop"].set()
+
+parser = argparse.ArgumentParser(description="입고 전 캐시 미리 받기")
+parser.add_argument("path", help="isbn_template.csv 서식 CSV 또는 한 줄에 ISBN 하나인 TXT")
+parser.add_argument("--rate", type=float, default=app.PREFETCH_RATE, help="초당 ISBN (기본 %(default)s)")
+parser.add_argument("--offline-653", action="store_true", help="653은 GPT 없이 로컬 추출만")
+args = parser.parse_args()
+
+with open(args.path, "rb") as f:
+    isbns = app.read_isbn_file(f.read(), args.path)
+print(f"ISBN {len(isbns):,}건, 초당 {args.rate}건")
+
+job = app.PrefetchJob(isbns, args.rate, args.offline_653).start()
+try:
+    while job.thread.is_alive():
+        job.thread.join(5)
+        print(job.state())
+except KeyboardInterrupt:
+    job.cancel()
+    job.thread.join()
+print(job.state())
@@ -0,0 +1,49 @@
+# 📏 008 조립 벤치마크: 기존 pad()/join 조립 vs 템플릿 bytearray 엔진(build_008_fast)
+#    실행: python 벤치마크_008.py   (.streamlit/secrets.toml 필요)
+import datetime
+import random
+import time
+
+import app
+
+
+def make_args(rng):
+    return dict(
+        date1=rng.choice(["2025", "2019", "1998", "19uu"]),
+        country3=rng.choice(["ulk", "ggk", "bnk", "   ", "us"]),
+        lang3=rng.choice(["kor", "eng", "jpn", "chi"]),
+        date2=rng.choice(["", "", "2024", "uuuu"]),
+        illus4=rng.choice(["", "a", "ad", "ado", "adoxx"]),
+        has_index=rng.choice(["0", "1", "", "y"]),
+        lit_form=rng.choice([" ", "f", "p", "e", "i", "m"]),
+        bio=rng.choice([" ", "a", "b", "d"]),
+        type_of_date=rng.choice(["s", "s", "m", "r"]),
+        modified_record=rng.choice([" ", " ", "x"]),
+        cataloging_src=rng.choice(["a", "a", "d", " "]),
+    )
+
+
+def main(n_records=100000, seed=7):
+    rng = random.Random(seed)
+    records = [make_args(rng) for _ in range(n_records)]
+
+    # 기존: 레코드마다 오늘 날짜 문자열 + pad()/join 조립
+    t0 = time.perf_counter()
+    legacy = [app.build_008_kormarc_bk(date_entered=datetime.datetime.now().strftime("%y%m%d"), **kw)
+              for kw in records]
+    t_legacy = time.perf_counter() - t0
+
+    app._008_template.cache_clear()
+    t0 = time.perf_counter()
+    fast = [app.build_008_fast(date_entered=app.today_yymmdd(), **kw) for kw in records]
+    t_fast = time.perf_counter() - t0
+
+    assert legacy == fast, "008 결과가 다릅니다"
+    print(f"레코드 {n_records}건")
+    print(f"  기존 pad()/join     : {t_legacy*1000:8.1f} ms ({t_legacy/n_records*1e6:6.2f} µs/레코드)")
+    print(f"  템플릿 bytearray    : {t_fast*1000:8.1f} ms ({t_fast/n_records*1e6:6.2f} µs/레코드)")
+    print(f"  속도 향상           : x{t_legacy/t_fast:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+# 📏 653 제외어 필터 벤치마크: 기존 이중 루프 vs ForbiddenIndex(길이별 해시 색인)
+#    실행: python 벤치마크_653필터.py   (.streamlit/secrets.toml 필요)
+import random
+import re
+import time
+import unicodedata
+
+import app
+
+# 기존 구현(비교 기준) — 매 호출마다 정규화 + 제외어 전체 이중 루프
+def legacy_norm(text):
+    if not text:
+        return ""
+    text = unicodedata.normalize("NFKC", text).lower()
+    text = re.sub(r"[^\w\s가-힣]", " ", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+def legacy_keep(kw, forbidden):
+    n = legacy_norm(kw)
+    if not n or len(n.replace(" ", "")) < 2:
+        return False
+    for tok in forbidden:
+        if tok in n or n in tok:
+            return False
+    return True
+
+
+def make_record(rng):
+    syll = "가나다라마바사아자차카타파하강산별빛바람시간기억도시여름겨울"
+    word = lambda k: "".join(rng.choice(syll) for _ in range(k))
+    title = " ".join(word(rng.randint(2, 4)) for _ in range(6))
+    authors = ", ".join(f"{word(3)} (지은이)" for _ in range(12)) + ", " + word(3) + " (옮긴이)"
+    kws = [word(rng.randint(2, 5)) for _ in range(40)]
+    return title, app._clean_author_str(authors), kws
+
+
+def main(n_records=2000, seed=7):
+    rng = random.Random(seed)
+    records = [make_record(rng) for _ in range(n_records)]
+
+    t0 = time.perf_counter()
+    legacy = []
+    for title, authors, kws in records:
+        forb = app._build_forbidden_set(title, authors)
+        kept, seen = [], set()
+        for kw in kws:                       # 1차 금칙어 필터 → 2차 정규화 중복 제거
+            if legacy_keep(kw, forb) and legacy_norm(kw) not in seen:
+                seen.add(legacy_norm(kw))
+                kept.append(kw)
+        legacy.append(kept)
+    t_legacy = time.perf_counter() - t0
+
+    app._norm.cache_clear()
+    app._build_forbidden_index.cache_clear()
+    t0 = time.perf_counter()
+    fast = []
+    for title, authors, kws in records:
+        index = app._build_forbidden_index(title, authors)
+        fast.append(app.filter_keywords(kws, index))
+    t_fast = time.perf_counter() - t0
+
+    assert legacy == fast, "판정 결과가 다릅니다"
+    n_kw = sum(len(r[2]) for r in records)
+    print(f"레코드 {n_records}건 / 후보 키워드 {n_kw}개")
+    print(f"  기존 이중 루프   : {t_legacy*1000:8.1f} ms ({t_legacy/n_kw*1e6:6.2f} µs/키워드)")
+    print(f"  ForbiddenIndex   : {t_fast*1000:8.1f} ms ({t_fast/n_kw*1e6:6.2f} µs/키워드)")
+    print(f"  속도 향상        : x{t_legacy/t_fast:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+# ✅ 020 엔진 점검: 한 건용 _resolve_020_one과 배치용 resolve_020(열 연산)이 같은 규칙으로 같은 값을 내는지
+#    (고정 사례 + 임의 조합). 020 규칙을 고칠 때는 두 곳을 같이 고치고 이 점검을 돌리세요.
+#    실행: python 점검_020.py   (.streamlit/secrets.toml 필요)
+import random
+
+import app
+
+ISBNS = ["9788936434267", "8936434268", "89-364-3426-8", "893643426X", "9791190000001", "9788936434268", ""]
+CASES = [
+    # (설명, 작업, 기대 tag_020, 기대 conflicts)
+    ("ISBN-10 입력 + 국중 ISBN-13",
+     {"isbn": "8936434268", "meta": {"price": "15000"},
+      "nlk": {"EA_ISBN": "9788936434267", "EA_ADD_CODE": "03810", "PRE_PRICE": "15000"}},
+     "=020  \\$a8936434268:$c15000$g03810", ""),
+    ("발행형태 5(예비) 부가기호",
+     {"isbn": "9788936434267", "meta": {"price": "15000"}, "nlk": {"EA_ADD_CODE": "05810"}},
+     "=020  \\$a9788936434267:$c15000", "부가기호 형식 오류"),
+    ("다른 ISBN의 국중 문서",
+     {"isbn": "9788936434267", "meta": {"price": ""},
+      "nlk": {"EA_ISBN": "9791190000001", "EA_ADD_CODE": "03810", "PRE_PRICE": "9000"}},
+     "=020  \\$a9788936434267", "국중 문서 ISBN 불일치"),
+    ("세트 ISBN",
+     {"isbn": "9788936434267", "meta": {"price": "15000"},
+      "nlk": {"EA_ISBN": "9788936434267", "EA_ADD_CODE": "03810",
+              "SET_ISBN": "9791190000001", "SET_ADD_CODE": "04810", "PRE_PRICE": "16000"}},
+     "=020  \\$a9788936434267:$c15000$g03810\n=020  1\\$a9791190000001(세트)$g04810", "알라딘·국중 정가 불일치"),
+]
+
+
+def random_job(rng):
+    pick = rng.choice
+    nlk = pick([None, {}, {
+        "EA_ISBN": pick(ISBNS), "EA_ADD_CODE": pick(["", "03810", "05810", "83810"]), "ADDCODE": pick(["", "04810"]),
+        "SET_ISBN": pick(ISBNS), "SET_ADD_CODE": pick(["", "04810", "09810"]), "PRE_PRICE": pick(["", "15000", "16000", None]),
+    }])
+    return {"isbn": pick(ISBNS) or "9788936434267", "meta": {"price": pick(["", "15000", 15000, "0", None, "12,000원"])},
+            "page": pick([None, {}, {"price": "13000"}]), "add_code": pick(["", "03810", "03510", "13"]), "nlk": nlk}
+
+
+def main(n_random=2000):
+    bad = []
+    for label, job, want_020, want_conflicts in CASES:
+        got = app._resolve_020_one(job)
+        if (got["tag_020"], got["conflicts"]) != (want_020, want_conflicts):
+            bad.append((label, want_020, want_conflicts, got))
+    rng = random.Random(20)
+    jobs = [job for _, job, _, _ in CASES] + [random_job(rng) for _ in range(n_random)]
+    batch = app.resolve_020(app.frame_020(jobs)).to_dict("records")
+    for job, rows in zip(jobs, batch):
+        one = app._resolve_020_one(job)
+        if one != rows:
+            bad.append(("한 건 ≠ 배치", job, rows, one))
+    for item in bad[:10]:
+        print("  ✗", *item)
+    total = len(CASES) + len(jobs)
+    print(f"{total - len(bad)}/{total} 통과")
+    raise SystemExit(1 if bad else 0)
+
+
+if __name__ == "__main__":
+    main()
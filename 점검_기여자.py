@@ -0,0 +1,37 @@
+# ✅ 기여자 파싱 점검: 알라딘 저자 문자열의 구분자(, ; /)마다 사람을 빠뜨리지 않는지
+#    실행: python 점검_기여자.py   (.streamlit/secrets.toml 필요)
+import app
+
+CASES = [
+    # (저자 문자열, 기대 (이름, 역할) 목록, 기대 245 책임표시)
+    ("박경리 (지은이), 김철수 (옮긴이)",
+     [("박경리", "aut"), ("김철수", "trl")], "$d박경리 지음 ;$e김철수 옮김"),
+    ("박경리 (지은이) ; 김철수 (옮긴이)",
+     [("박경리", "aut"), ("김철수", "trl")], "$d박경리 지음 ;$e김철수 옮김"),
+    ("박경리 (지은이) / 김철수 (옮긴이)",
+     [("박경리", "aut"), ("김철수", "trl")], "$d박경리 지음 ;$e김철수 옮김"),
+    ("박경리;김철수 (지은이)",
+     [("박경리", "aut"), ("김철수", "aut")], "$d박경리, $e김철수 지음"),
+    ("홍길동, 이몽룡 (지은이); 성춘향 (그림)",
+     [("홍길동", "aut"), ("이몽룡", "aut"), ("성춘향", "ill")], "$d홍길동, $e이몽룡 지음 ;$e성춘향 그림"),
+    ("김영희 (지은이) / 이철수 (그림) / 박민수 (옮긴이)",
+     [("김영희", "aut"), ("이철수", "ill"), ("박민수", "trl")], "$d김영희 지음 ;$e이철수 그림 ;$e박민수 옮김"),
+]
+
+
+def main():
+    bad = []
+    for author, want_people, want_245 in CASES:
+        contributors = app.parse_contributors(author)
+        people = [(c.name, c.role) for c in contributors]
+        line_245 = app.build_245_responsibility(contributors)
+        if people != want_people or line_245 != want_245:
+            bad.append((author, want_people, people, want_245, line_245))
+    for author, want_people, people, want_245, line_245 in bad:
+        print(f"  ✗ {author}\n      기대 {want_people} {want_245}\n      결과 {people} {line_245}")
+    print(f"{len(CASES) - len(bad)}/{len(CASES)} 통과")
+    raise SystemExit(1 if bad else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+# ✅ 자료유형 판별 점검: 흔한 도서 분류는 단행본(BK), 매체 분류만 비도서로
+#    실행: python 점검_자료유형.py   (.streamlit/secrets.toml 필요)
+import app
+
+CASES = [
+    # (mallType, 분류, 기대 유형)
+    ("BOOK", "국내도서>소설/시/희곡>한국소설>한국 장편소설", "BK"),
+    ("BOOK", "국내도서>컴퓨터/모바일>컴퓨터 공학>소프트웨어 공학", "BK"),
+    ("BOOK", "국내도서>컴퓨터/모바일>그래픽/디자인/멀티미디어>포토샵", "BK"),
+    ("BOOK", "국내도서>유아>놀이책>교구", "BK"),
+    ("BOOK", "국내도서>어린이>학습>CD-ROM 교재", "BK"),
+    ("FOREIGN", "외국도서>컴퓨터>Software Engineering", "BK"),
+    ("BOOK", "국내도서>잡지 편집론", "BK"),
+    ("BOOK", "국내도서>잡지>월간지", "CR"),
+    ("EBOOK", "eBook>소설/시/희곡>한국소설", "EB"),
+    ("MUSIC", "음반>가요>발라드", "MU"),
+    ("BOOK", "국내도서>오디오북>소설", "AU"),
+    ("DVD", "DVD>애니메이션", "VM"),
+    ("DVD", "블루레이>영화", "VM"),
+    ("", "교구/키트>과학 키트", "KT"),
+    ("", "소프트웨어>교육용", "CF"),
+]
+
+
+def main():
+    bad = [(mall, cat, want, got) for mall, cat, want in CASES
+           if (got := app.detect_material_format(mall, cat)) != want]
+    for mall, cat, want, got in bad:
+        print(f"  ✗ {mall or '-':7} {cat}: 기대 {want}, 결과 {got}")
+    print(f"{len(CASES) - len(bad)}/{len(CASES)} 통과")
+    raise SystemExit(1 if bad else 0)
+
+
+if __name__ == "__main__":
+    main()